@@ -0,0 +1,81 @@
+import numpy as np
+import environment
+
+
+class ArrayEnvironment(environment.Environment):
+    """
+    Environment that mirrors the occupancy of the grid in dense NumPy arrays.
+
+    Each occupied location stores the registry id of the plant that owns it and the time at which the cell came to life
+    (empty locations hold -1 and a creation time that never expires).  The energy phases then run as whole-grid array
+    operations, and energy is applied to the registry's energy array with a single scatter-add, rather than visiting
+    each location and plant in Python.  Seed cells never occupy the grid (they die as soon as they are grown), so no
+    seed flag is stored.
+
+    For the same random seed, the results match Environment step for step.
+    """
+
+    never_expires = np.iinfo(np.int32).max
+
+    def __init__(self, width, height, seed=None):
+        super(ArrayEnvironment, self).__init__(width, height, seed)
+        self.plant_ids = np.full((width, height), -1, dtype=np.int32)
+        self.creation_times = np.full((width, height), ArrayEnvironment.never_expires, dtype=np.int32)
+
+    def place_cell(self, x, y, cell):
+        """ Records that the specified living cell now occupies location (x, y). """
+
+        super(ArrayEnvironment, self).place_cell(x, y, cell)
+        self.plant_ids[x, y] = cell.plant.id
+        self.creation_times[x, y] = cell.creation_time
+
+    def restore_cells(self, cells, xs, ys, plant_ids, creation_times):
+        """ Records that the specified living cells of a checkpoint occupy their locations, as described in
+        Environment.restore_cells.
+        """
+
+        super(ArrayEnvironment, self).restore_cells(cells, xs, ys, plant_ids, creation_times)
+        self.plant_ids[xs, ys] = plant_ids
+        self.creation_times[xs, ys] = creation_times
+
+    def remove_cell(self, x, y, cell):
+        """ Records that the specified cell died and no longer occupies location (x, y). """
+
+        super(ArrayEnvironment, self).remove_cell(x, y, cell)
+        self.plant_ids[x, y] = -1
+        self.creation_times[x, y] = ArrayEnvironment.never_expires
+
+    def plant_id_grid(self):
+        """ Returns a (width, height) array of the registry id of the plant occupying each location, or -1 if empty. """
+        return self.plant_ids
+
+    def _give_energy(self):
+        """ Gives energy to the topmost cell in each column. """
+
+        columns = np.flatnonzero(self.column_tops >= 0)
+        self._give_energy_for(np.bincount(self.plant_ids[columns, self.column_tops[columns]],
+                                          minlength=self.plant_manager.registry.capacity()))
+
+    def canopy_plant_ids(self, start=0, stop=None):
+        """ Returns an array of the registry id of the plant that owns the topmost cell, and so receives the sunlight,
+        of each column from start up to stop, or -1 if the column is empty.
+        """
+
+        tops = self.column_tops[start:stop]
+        columns = np.arange(self.width)[start:stop]
+        return np.where(tops >= 0, self.plant_ids[columns, np.maximum(tops, 0)], -1)
+
+    def _take_energy(self):
+        """ Takes energy from each plant for each cell that the plan has which is alive, as in Environment. """
+
+        self._take_energy_for(np.bincount(self.plant_ids[self.plant_ids >= 0],
+                                          minlength=self.plant_manager.registry.capacity()))
+
+    def _cell_locations_of(self, selected):
+        """ Returns the (x, y) of every living cell of the plants whose ids are selected, in column-major order from the
+        top of each column.
+        """
+
+        xs, ys = np.nonzero(selected[np.maximum(self.plant_ids, 0)] & (self.plant_ids >= 0))
+        order = np.lexsort((-ys, xs))
+        return zip(xs[order].tolist(), ys[order].tolist())
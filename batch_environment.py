@@ -0,0 +1,107 @@
+import functools
+import logging
+import numpy as np
+import array_environment
+
+
+class EnvironmentBatch(object):
+    """
+    Advances many independent environments of the same size in lockstep.
+
+    Each member is an ArrayEnvironment with its own seed, plants, registry and counters, but its plant id, creation time
+    and column top arrays are views into stacked (count, width, height) and (count, width) arrays owned by the batch.
+    The energy phases then run as single array operations across every member: each member's registry ids are offset
+    past those of the members before it, so one scatter-add counts the cells of every plant in the batch, and each
+    member applies its own slice of the counts in place of its energy phases.  The remaining phases are driven by the
+    plants and cells that changed, so they run member by member.  Each member then ends its step as it would on its own,
+    so its metrics, phase hooks, population recorder and observers work just the same.
+
+    A member drops out of the batch once all of its plants are dead, and the others carry on without it.  For the same
+    seed, each member matches an ArrayEnvironment run on its own step for step.
+    """
+
+    def __init__(self, width, height, seeds):
+        """
+        seeds: one random seed for each member
+        """
+
+        self.width = width
+        self.height = height
+        self.time = 0
+        count = len(seeds)
+        self.plant_ids = np.full((count, width, height), -1, dtype=np.int32)
+        self.creation_times = np.full((count, width, height), array_environment.ArrayEnvironment.never_expires,
+                                      dtype=np.int32)
+        self.column_tops = np.full((count, width), -1, dtype=np.int32)
+        self.members = []
+        for index, seed in enumerate(seeds):
+            member = array_environment.ArrayEnvironment(width, height, seed)
+            member.plant_ids = self.plant_ids[index]
+            member.creation_times = self.creation_times[index]
+            member.column_tops = self.column_tops[index]
+            self.members.append(member)
+        self.running = list(range(count))  # index of each member that has not yet finished
+
+    def basic_plants(self, count):
+        """ Creates count basic plants spread evenly across the width of each member. """
+
+        for member in self.members:
+            member.plant_manager.basic_plants(member, count)
+
+    def complete_death(self):
+        """ Returns a list of whether all plants are dead, for each member. """
+
+        return [member.complete_death() for member in self.members]
+
+    def living_counts(self):
+        """ Returns a list of the number of living plants, for each member. """
+
+        return [member.plant_manager.living_count() for member in self.members]
+
+    def _drop_finished(self):
+        """ Removes the members in which all plants are dead from the running members. """
+
+        self.running = [index for index in self.running if not self.members[index].complete_death()]
+
+    def step_time(self):
+        """ Takes one step in time in every running member, and then drops those that have finished.
+
+        :return: None
+        """
+
+        self._drop_finished()
+        if not self.running:
+            return
+        if self.time % 500 == 0:
+            logging.info("Cycle %d running members: %d of %d" % (self.time, len(self.running), len(self.members)))
+
+        if len(self.running) == len(self.members):
+            plant_ids, column_tops = self.plant_ids, self.column_tops
+        else:
+            plant_ids, column_tops = self.plant_ids[self.running], self.column_tops[self.running]
+        members = [self.members[index] for index in self.running]
+        # offsets[i] is added to the ids of the i-th running member so that the ids of all members are distinct
+        offsets = np.zeros(len(members) + 1, dtype=np.int64)
+        np.cumsum([member.plant_manager.registry.capacity() for member in members], out=offsets[1:])
+
+        # Giving energy does not change the grids, so both sets of counts can be taken before either is applied
+        indexes, xs = np.nonzero(column_tops >= 0)
+        ids = plant_ids[indexes, xs, column_tops[indexes, xs]]
+        given_counts = np.bincount(ids + offsets[indexes], minlength=offsets[-1])
+        occupied = plant_ids >= 0
+        indexes = np.repeat(np.arange(len(members)), occupied.reshape(len(members), -1).sum(axis=1))
+        taken_counts = np.bincount(plant_ids[occupied] + offsets[indexes], minlength=offsets[-1])
+
+        for member, start, stop in zip(members, offsets[:-1].tolist(), offsets[1:].tolist()):
+            energy_phases = {"give_energy": functools.partial(member._give_energy_for, given_counts[start:stop]),
+                             "take_energy": functools.partial(member._take_energy_for, taken_counts[start:stop])}
+            member._run_phases([(name, energy_phases.get(name, phase)) for name, phase in member.phases()])
+            member._end_step()
+        self.time += 1
+        self._drop_finished()
+
+    def run(self, cycle_count):
+        """ Steps the batch until every member has finished or cycle_count cycles have passed. """
+
+        while self.time < cycle_count and self.running:
+            self.step_time()
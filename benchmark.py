@@ -0,0 +1,147 @@
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import time
+import environment
+import array_environment
+import sparse_environment
+
+
+def benchmark(config):
+    """ Builds a seeded environment, warms it up to a steady population, and then times each phase of step_time.
+
+    config: dictionary with the keys backend, width, height, plant_count, seed, warmup, and cycles.
+    :return: dictionary of the config plus the measured results
+    """
+
+    if config["backend"] == "array":
+        env = array_environment.ArrayEnvironment(config["width"], config["height"], config["seed"])
+    elif config["backend"] == "sparse":
+        env = sparse_environment.SparseEnvironment(config["width"], config["height"], config["seed"])
+    else:
+        env = environment.Environment(config["width"], config["height"], config["seed"])
+    env.plant_manager.basic_plants(env, config["plant_count"])
+    for _ in range(config["warmup"]):
+        env.step_time()
+
+    phase_seconds = dict((name, 0.0) for name, _ in env.phases())
+    start = time.perf_counter()
+    for _ in range(config["cycles"]):
+        for name, phase in env.phases():
+            phase_start = time.perf_counter()
+            phase()
+            phase_seconds[name] += time.perf_counter() - phase_start
+        env.time += 1
+    elapsed = time.perf_counter() - start
+
+    cell_cycles = float(config["cycles"] * config["width"] * config["height"])
+    result = dict(config)
+    result.update({"living_plants": env.plant_manager.living_count(),
+                   "cycles_per_sec": config["cycles"] / elapsed,
+                   "ns_per_cell": dict((name, seconds * 1e9 / cell_cycles) for name, seconds in phase_seconds.items()),
+                   "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
+    return result
+
+
+def configs(backends, sizes, plant_counts, seed, warmup, cycles):
+    """ Returns the list of benchmark configurations for every combination of backend, size and plant count. """
+
+    return [{"backend": backend, "width": width, "height": height, "plant_count": plant_count, "seed": seed,
+             "warmup": warmup, "cycles": cycles}
+            for backend in backends for width, height in sizes for plant_count in plant_counts]
+
+
+def run(config_list):
+    """ Runs each benchmark in a fresh process so that peak memory use is measured independently. """
+
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        return pool.map(benchmark, config_list, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _key(result):
+    return result["backend"], result["width"], result["height"], result["plant_count"]
+
+
+def compare(results, baseline, threshold):
+    """ Compares results against a baseline run and returns a list of lines describing each difference.
+
+    A line starting with REGRESSION is reported when cycles/sec drops or ns/cell for a phase rises by more than the
+    threshold fraction.
+    """
+
+    baseline_results = dict((_key(result), result) for result in baseline)
+    lines = []
+    for result in results:
+        old = baseline_results.get(_key(result))
+        if old is None:
+            lines.append("%s %dx%d plants=%d: no baseline" % _key(result))
+            continue
+        measures = [("cycles_per_sec", old["cycles_per_sec"] / result["cycles_per_sec"])]
+        for name, ns in sorted(result["ns_per_cell"].items()):
+            if old["ns_per_cell"].get(name):
+                measures.append((name, ns / old["ns_per_cell"][name]))
+        for name, slowdown in measures:
+            label = "REGRESSION" if slowdown > 1 + threshold else "ok"
+            lines.append("%s %s %dx%d plants=%d %s: %.2fx time" % ((label,) + _key(result) + (name, slowdown)))
+    return lines
+
+
+def _size(text):
+    width, _, height = text.partition("x")
+    return int(width), int(height)
+
+
+def main():
+    """
+    Benchmarks each phase of Environment.step_time across world sizes and initial plant counts, writes the results as
+    JSON, and optionally compares them against a saved baseline.
+
+    :return: None
+    """
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-b", "--backends", dest="backends", default="object,array",
+                        help="Comma separated grid engines to benchmark")
+    parser.add_argument("--sizes", dest="sizes", default="300x20,3000x20,3000x200",
+                        help="Comma separated WIDTHxHEIGHT world sizes")
+    parser.add_argument("-pc", "--plant_counts", dest="plant_counts", default="10,100",
+                        help="Comma separated initial plant counts")
+    parser.add_argument("-s", "--seed", dest="seed", type=int, default="1", help="Random seed of every environment")
+    parser.add_argument("-w", "--warmup", dest="warmup", type=int, default="300",
+                        help="Number of cycles to run before timing")
+    parser.add_argument("-c", "--cycles", dest="cycles", type=int, default="50", help="Number of cycles to time")
+    parser.add_argument("-o", "--output", dest="output", default=None,
+                        help="File to which the JSON results are written (defaults to standard output)")
+    parser.add_argument("--baseline", dest="baseline", default=None,
+                        help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", dest="threshold", type=float, default="0.1",
+                        help="Fractional slowdown relative to the baseline reported as a regression")
+
+    args = parser.parse_args()
+
+    results = run(configs(args.backends.split(","), [_size(size) for size in args.sizes.split(",")],
+                          [int(count) for count in args.plant_counts.split(",")], args.seed, args.warmup, args.cycles))
+    text = json.dumps({"python": sys.version.split()[0], "results": results}, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            lines = compare(results, json.load(baseline_file)["results"], args.threshold)
+        for line in lines:
+            sys.stderr.write(line + "\n")
+        if any(line.startswith("REGRESSION") for line in lines):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
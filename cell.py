@@ -1,4 +1,4 @@
-import logging
+import tracing
 
 
 class CellState(object):
@@ -7,18 +7,23 @@ class CellState(object):
 
 
 class Cell(object):
-    """ A single cell that may be in any CellState and is a component of one plant
+    """ A cell of one plant that is growing or has grown into a location of the environment.
     Each cell has a location relative to the root cell of a plant.  A cell can either be a normal cell or a seed cell.
+
+    A plant only tracks the state of each entry in its genome, so a Cell object exists only from the time that the
+    plant grows it until it dies.  index is the position of the cell in the plant's genome, or None after a removal
+    mutation has dropped it from the genome while it was still alive.
     """
 
-    def __init__(self, plant, dx, dy, seed=False):
+    __slots__ = ("plant", "index", "dx", "dy", "seed", "_state", "creation_time", "connected_time")
+
+    def __init__(self, plant, index):
         self.plant = plant
-        self.dx = dx
-        self.dy = dy
-        self.seed = seed
+        self.index = index
+        self.dx, self.dy, self.seed = plant.genome[index]
         self._state = CellState.PENDING
+        self.creation_time = -1
         self.connected_time = -1  # latest time it was verified as being connected
-        self.birth_time = plant.env.time
         return
 
     def state(self):
@@ -27,20 +32,16 @@ class Cell(object):
 
     def age(self):
         """ Returns the current age of the cell relative to when this cell came to life. """
-        return self.plant.env.time - self.birth_time
+        return self.plant.env.time - self.creation_time
 
-    def is_space_available(self):
-        """ Returns boolean indicate whether the space where this cell would grow is unoccupied. """
-        x = self.plant.root_x + self.dx
-        y = self.plant.root_y + self.dy
-        env = self.plant.env
-        return env.is_space_available(x, y)
-
-    def set_living(self, alive):
+    def set_living(self, alive, cause=0):
         """ Changes this cell's state to the be alive or dead.
 
         Function ignores the request if the requested state matches the current state.
-        Updates the environment by adding/removing the cell that grew/died.
+        Updates the environment by adding/removing the cell that grew/died, and the plant's state for the cell's genome
+        entry.
+
+        cause: why the cell died, as one of the cell causes in tracing, for the environment's tracer
         """
 
         env = self.plant.env
@@ -52,21 +53,33 @@ class Cell(object):
             self.creation_time = env.time
             if self.seed:
                 self._state = CellState.DEAD
-                logging.debug("Seed cell is now dead root: (%d, %d) delta: (%d, %d)" %
-                              (self.plant.root_x, self.plant.root_y, self.dx, self.dy))
+                self.plant.cell_states[self.index] = CellState.DEAD
             else:
                 self._state = CellState.ALIVE
-                env.cells[self.plant.root_x + self.dx][self.plant.root_y + self.dy] = self
+                self.plant.cell_states[self.index] = CellState.ALIVE
+                env.place_cell(self.plant.root_x + self.dx, self.plant.root_y + self.dy, self)
                 self.plant.living_cell_count += 1
-                logging.debug("Cell is now alive. root: (%d, %d) delta: (%d, %d) plant age: %d" %
-                              (self.plant.root_x, self.plant.root_y, self.dx, self.dy, self.plant.age()))
+                self.plant.living_cells[self] = None
+                if env.metrics is not None:
+                    env.metrics.cells_born += 1
+                if env.tracer is not None:
+                    env.tracer.record(env.time, tracing.CELL_BORN, self.plant.id, self.plant.root_x + self.dx,
+                                      self.plant.root_y + self.dy)
+                if env.state_hash is not None:
+                    env.state_hash.cell_toggled(self.plant.root_x + self.dx, self.plant.root_y + self.dy, self.plant)
         else:
             if self._state is CellState.DEAD:
                 return
             if self._state is CellState.PENDING:
                 raise Exception("Cannot kill a pending cell")
             self._state = CellState.DEAD
-            env.cells[self.plant.root_x + self.dx][self.plant.root_y + self.dy] = None
+            if self.index is not None:
+                self.plant.cell_states[self.index] = CellState.DEAD
+            env.remove_cell(self.plant.root_x + self.dx, self.plant.root_y + self.dy, self)
             self.plant.living_cell_count -= 1
-            logging.debug("Cell is now dead. root: (%d, %d) delta: (%d, %d) cell age: %d  plant age: %d" %
-                          (self.plant.root_x, self.plant.root_y, self.dx, self.dy, self.age(), self.plant.age()))
+            del self.plant.living_cells[self]
+            if env.tracer is not None:
+                env.tracer.record(env.time, tracing.CELL_DIED, self.plant.id, self.plant.root_x + self.dx,
+                                  self.plant.root_y + self.dy, cause, env.time - self.creation_time)
+            if env.state_hash is not None:
+                env.state_hash.cell_toggled(self.plant.root_x + self.dx, self.plant.root_y + self.dy, self.plant)
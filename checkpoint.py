@@ -0,0 +1,168 @@
+import gc
+import json
+import numpy as np
+import cell as c
+import genome
+import plant as p
+
+checkpoint_version = 4
+
+
+def save(env, path, compressed=False):
+    """ Writes the complete state of an environment to a .npz file at path, which is zip compressed if compressed is
+    set.
+
+    The file holds the environment dimensions, time and any parameters overridden on the instance, the PlantManager
+    counters, the state of the environment's random number stream, and flat tables of the distinct genomes, of the
+    plants (in growth order, followed by any created since the last growth phase) with the state of each of their
+    genome entries, and of the living cells of each plant.  Plants keep their registry ids, and the registry's free list
+    is saved too, so that ids (which break ties in batched growth) are given out just as they would have been.  Must be
+    called between steps.
+    """
+
+    plants = env.plant_manager.plants + env.plant_manager._new_plants
+    genome_numbers = {}
+    genomes = []
+    for plant in plants:
+        if plant.genome not in genome_numbers:
+            genome_numbers[plant.genome] = len(genomes)
+            genomes.append(plant.genome)
+    entries = [entry for plant_genome in genomes for entry in plant_genome.entries]
+    # The registry holds most of the state of the plants, in arrays indexed by plant id
+    registry = env.plant_manager.registry
+    plant_ids = np.fromiter((plant.id for plant in plants), dtype=np.intp, count=len(plants))
+    cells = [cell for plant in plants for cell in plant.living_cells]
+
+    parameters = dict((name, value) for name, value in vars(env).items() if hasattr(type(env), name))
+    write = np.savez_compressed if compressed else np.savez
+    write(path,
+          version=checkpoint_version,
+          width=env.width,
+          height=env.height,
+          time=env.time,
+          parameters=json.dumps(parameters),
+          birth_count=env.plant_manager.birth_count,
+          death_count=env.plant_manager.death_count,
+          new_plant_count=len(env.plant_manager._new_plants),
+          registry_capacity=registry.capacity(),
+          registry_free_ids=np.array(registry._free_ids, dtype=np.int32),
+          rng_state=json.dumps(env.rng.getstate()),
+          genome_length=np.array([len(plant_genome) for plant_genome in genomes], dtype=np.int32),
+          genome_dx=np.array([dx for dx, _, _ in entries], dtype=np.int32),
+          genome_dy=np.array([dy for _, dy, _ in entries], dtype=np.int32),
+          genome_seed=np.array([seed for _, _, seed in entries], dtype=bool),
+          plant_id=plant_ids.astype(np.int32),
+          plant_genome=np.array([genome_numbers[plant.genome] for plant in plants], dtype=np.int32),
+          plant_cell_states=np.frombuffer(b"".join(bytes(plant.cell_states) for plant in plants), dtype=np.uint8),
+          plant_root_x=registry.root_x[plant_ids].astype(np.int32),
+          plant_root_y=np.array([plant.root_y for plant in plants], dtype=np.int32),
+          plant_energy=registry.energy[plant_ids],
+          plant_alive=registry.alive[plant_ids],
+          plant_creation_time=registry.creation_time[plant_ids].astype(np.int32),
+          plant_color=registry.color[plant_ids],
+          plant_living_count=registry.living_cell_count[plant_ids].astype(np.int32),
+          cell_index=np.array([-1 if cell.index is None else cell.index for cell in cells], dtype=np.int32),
+          cell_dx=np.array([cell.dx for cell in cells], dtype=np.int32),
+          cell_dy=np.array([cell.dy for cell in cells], dtype=np.int32),
+          cell_creation_time=np.array([cell.creation_time for cell in cells], dtype=np.int32),
+          cell_connected_time=np.array([cell.connected_time for cell in cells], dtype=np.int32))
+
+
+def load(environment_class, path):
+    """ Creates an instance of environment_class with the state stored in the checkpoint at path.
+
+    The random number stream is restored as well, so that the simulation continues exactly as it would have if it
+    had not been interrupted.
+    """
+
+    data = np.load(path)
+    if int(data["version"]) != checkpoint_version:
+        raise Exception("Unsupported checkpoint version %d" % int(data["version"]))
+    # Every plant and cell created here survives, so the garbage collections that creating them would trigger are
+    # wasted, and cost more than the rest of the load in a large world
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return _restore(environment_class, data)
+    finally:
+        if collecting:
+            gc.enable()
+
+
+def _restore(environment_class, data):
+    """ Returns an instance of environment_class with the state stored in the loaded checkpoint data. """
+
+    env = environment_class(int(data["width"]), int(data["height"]))
+    env.time = int(data["time"])
+    for name, value in json.loads(str(data["parameters"])).items():
+        setattr(env, name, value)
+    env.plant_manager.birth_count = int(data["birth_count"])
+    env.plant_manager.death_count = int(data["death_count"])
+
+    genomes = []
+    start = 0
+    entries = list(zip(data["genome_dx"].tolist(), data["genome_dy"].tolist(), data["genome_seed"].tolist()))
+    for length in data["genome_length"].tolist():
+        genomes.append(genome.Genome.intern(entries[start:start + length]))
+        start += length
+
+    # Plants and cells are restored directly rather than through their constructors, which would register them as
+    # newly created and stamp them with the current time.  Plants keep their ids, which break ties in batched growth,
+    # and the state that the registry holds is restored for all of them at once.
+    registry = env.plant_manager.registry
+    registry.restore_free_ids(int(data["registry_capacity"]), data["registry_free_ids"].tolist())
+    plant_ids = data["plant_id"]
+    registry.energy[plant_ids] = data["plant_energy"]
+    registry.alive[plant_ids] = data["plant_alive"]
+    registry.creation_time[plant_ids] = data["plant_creation_time"]
+    registry.root_x[plant_ids] = data["plant_root_x"]
+    registry.color[plant_ids] = data["plant_color"]
+    registry.living_cell_count[plant_ids] = data["plant_living_count"]
+
+    plants = []
+    cells = []
+    state_start = 0
+    cell_start = 0
+    cell_states = data["plant_cell_states"].tobytes()
+    cell_columns = list(zip(data["cell_index"].tolist(), data["cell_dx"].tolist(), data["cell_dy"].tolist(),
+                            data["cell_creation_time"].tolist(), data["cell_connected_time"].tolist()))
+    for plant_id, genome_number, root_y, living_count in zip(plant_ids.tolist(), data["plant_genome"].tolist(),
+                                                              data["plant_root_y"].tolist(),
+                                                              data["plant_living_count"].tolist()):
+        plant = p.Plant.__new__(p.Plant)
+        plant.env = env
+        plant._registry = registry
+        plant.id = registry.add(plant, plant_id)
+        plant.root_y = root_y
+        plant.genome = genomes[genome_number]
+        plant.cell_states = bytearray(cell_states[state_start:state_start + len(plant.genome)])
+        plant.living_cells = {}
+        for index, dx, dy, cell_creation_time, connected_time in cell_columns[cell_start:cell_start + living_count]:
+            cell = c.Cell.__new__(c.Cell)
+            cell.plant = plant
+            cell.index = None if index < 0 else index
+            cell.dx = dx
+            cell.dy = dy
+            cell.seed = False
+            cell._state = c.CellState.ALIVE
+            cell.creation_time = cell_creation_time
+            cell.connected_time = connected_time
+            plant.living_cells[cell] = None
+            cells.append(cell)
+        state_start += len(plant.genome)
+        cell_start += living_count
+        plants.append(plant)
+
+    living_counts = data["plant_living_count"]
+    env.restore_cells(cells, np.repeat(data["plant_root_x"], living_counts) + data["cell_dx"],
+                      np.repeat(data["plant_root_y"], living_counts) + data["cell_dy"],
+                      np.repeat(plant_ids, living_counts), data["cell_creation_time"])
+    # Plants created since the last growth phase, such as the initial plants, do not grow until the next one
+    new_plant_count = int(data["new_plant_count"])
+    env.plant_manager.plants = plants[:len(plants) - new_plant_count]
+    env.plant_manager._new_plants = plants[len(plants) - new_plant_count:]
+    for plant in plants:
+        plant.build_growth_queue()
+
+    env.rng.setstate(json.loads(str(data["rng_state"])))
+    return env
@@ -1,4 +1,10 @@
 import environment
+import array_environment
+import sparse_environment
+import steady_state
+import parallel
+import renderer
+import replay
 import logging
 import argparse
 
@@ -20,33 +26,143 @@ def main():
                         help="Number of cycles to execute")
     parser.add_argument("-dt", "--display_time", dest="display_time", type=int, default="100",
                         help="Time at which to display the initial state")
+    parser.add_argument("-b", "--backend", dest="backend", choices=["object", "array", "sparse"],
+                        default="object",
+                        help="Grid engine: per-location Python objects, NumPy arrays, or chunks allocated on demand")
+    parser.add_argument("-s", "--seed", dest="seed", type=int, default=None,
+                        help="Seed of the random number stream, for a reproducible run (random if not given)")
+    parser.add_argument("--strips", dest="strips", type=int, default="1",
+                        help="Number of column strips simulated in parallel worker processes (1 runs in this process)")
+    parser.add_argument("--halo", dest="halo", type=int, default="32",
+                        help="Number of columns past the edge of its strip that a plant can reach")
+    parser.add_argument("--checkpoint-every", dest="checkpoint_every", type=int, default="0",
+                        help="Number of cycles between checkpoints (0 disables checkpoints)")
+    parser.add_argument("--checkpoint-path", dest="checkpoint_path", default="darwin_checkpoint.npz",
+                        help="File to which checkpoints are written")
+    parser.add_argument("--resume", dest="resume", default=None,
+                        help="Checkpoint file from which to resume a previous run")
+    parser.add_argument("--metrics", dest="metrics", default=None,
+                        help="JSON lines file to which per-phase timers and population counters are written")
+    parser.add_argument("--metrics-interval", dest="metrics_interval", type=int, default="500",
+                        help="Number of cycles covered by each metrics record")
+    parser.add_argument("--trace", dest="trace", default=None,
+                        help="File to which cell, plant, seed and mutation events are written (read with tracing.read)")
+    parser.add_argument("--population", dest="population", default=None,
+                        help="File to which a per-cycle population time series and lineage table are written "
+                             "(read with population.read)")
+    parser.add_argument("--replay-log", dest="replay_log", default=None,
+                        help="Directory to which keyframes are written so that any cycle can be reconstructed later")
+    parser.add_argument("--keyframe-every", dest="keyframe_every", type=int, default="1000",
+                        help="Number of cycles between replay keyframes")
+    parser.add_argument("--stop-at-steady-state", dest="stop_at_steady_state", action="store_true",
+                        help="Stop once the configuration is confirmed to repeat, or the population to be stationary")
+    parser.add_argument("--steady-window", dest="steady_window", type=int, default="1000",
+                        help="Longest period of repeat, and number of cycles a stationary population is watched")
+    parser.add_argument("--stationary-tolerance", dest="stationary_tolerance", type=int, default=None,
+                        help="Largest change in the number of living plants over the window that is stationary")
+    parser.add_argument("--frames", dest="frames", default=None,
+                        help="Directory (png), file (raw) or video file (ffmpeg) to which frames are recorded")
+    parser.add_argument("--frame-format", dest="frame_format", choices=["png", "raw", "ffmpeg"], default="png",
+                        help="How recorded frames are stored")
+    parser.add_argument("--frame-every", dest="frame_every", type=int, default="10",
+                        help="Number of cycles between recorded frames")
+    parser.add_argument("--headless", dest="headless", action="store_true",
+                        help="Never display the environment with pyplot")
 
     args = parser.parse_args()
+    if args.strips > 1 and (args.resume or args.checkpoint_every or args.metrics or args.trace or
+                            args.population or args.replay_log or args.stop_at_steady_state):
+        parser.error("--strips cannot be combined with checkpoints, metrics, tracing, population records, replay "
+                     "logs or steady state detection")
 
     environment_width = args.width
     environment_height = args.height
 
-    print("Environment: width: %d height: %d" % (environment_width, environment_height))
     initial_plant_count = args.plant_count
 
-    # Create the one and only environment in which all plants will grow
-    env = environment.Environment(environment_width, environment_height)
+    if args.backend == "array":
+        environment_class = array_environment.ArrayEnvironment
+    elif args.backend == "sparse":
+        environment_class = sparse_environment.SparseEnvironment
+    else:
+        environment_class = environment.Environment
 
-    # Create a few initial plants which are spread evenly in the environment
-    for x in range(initial_plant_count):
-        env.plant_manager.basic_plant(env, env.energy_in_new_plant, (x + 1) *
-                                      environment_width // (initial_plant_count + 1), 2, 1)
+    if args.strips > 1:
+        # Split the world into strips that are stepped in parallel
+        env = parallel.ParallelEnvironment(environment_width, environment_height, args.strips,
+                                           seed=args.seed, halo=args.halo)
+        env.basic_plants(initial_plant_count)
+    elif args.resume:
+        # Continue a previous run from where its checkpoint left off
+        env = environment_class.load(args.resume)
+        print("Resumed from %s at cycle_time: %d" % (args.resume, env.time))
+    else:
+        # Create the one and only environment in which all plants will grow
+        env = environment_class(environment_width, environment_height, args.seed)
 
-    for cycle_time in range(args.cycle_count):
+        # Create a few initial plants which are spread evenly in the environment
+        env.plant_manager.basic_plants(env, initial_plant_count)
+    print("Environment: width: %d height: %d" % (env.width, env.height))
+    if args.metrics:
+        env.enable_metrics(args.metrics, args.metrics_interval)
+    if args.trace:
+        env.enable_tracing(args.trace)
+    if args.population:
+        env.enable_population(args.population)
+    replay_recorder = None
+    if args.replay_log:
+        replay_recorder = replay.ReplayRecorder(args.replay_log, env, args.keyframe_every)
+        env.observers.append(replay_recorder)
+    steady_state_detector = None
+    if args.stop_at_steady_state:
+        env.enable_state_hash()
+        steady_state_detector = steady_state.SteadyStateDetector(args.steady_window,
+                                                                 stationary_tolerance=args.stationary_tolerance)
+        env.observers.append(steady_state_detector)
+    frame_recorder = None
+    if args.frames:
+        if args.frame_format == "raw":
+            sink = renderer.RawRGBSink(args.frames)
+        elif args.frame_format == "ffmpeg":
+            sink = renderer.FFmpegSink(args.frames, env.width, env.height)
+        else:
+            sink = renderer.PNGSequenceSink(args.frames)
+        frame_recorder = renderer.FrameRecorder(sink, args.frame_every)
+        env.observers.append(frame_recorder)
+
+    for cycle_time in range(env.time, args.cycle_count):
         env.step_time()
         if env.complete_death():
             print("Complete death of all plants! cycle_time: %d" % cycle_time)
             break
+        if steady_state_detector is not None and steady_state_detector.kind is not None:
+            if steady_state_detector.kind == "cycle":
+                print("Configuration repeats every %d cycles, confirmed at cycle_time: %d" %
+                      (steady_state_detector.period, cycle_time))
+                print("Projected births: %d deaths: %d at cycle_time: %d" %
+                      (steady_state_detector.projected_counts(args.cycle_count) + (args.cycle_count,)))
+            else:
+                print("Population stationary at %d living plants, confirmed at cycle_time: %d" %
+                      (env.plant_manager.living_count(), cycle_time))
+            break
+        if args.checkpoint_every and env.time % args.checkpoint_every == 0:
+            env.save(args.checkpoint_path)
         # show an initial state
-        if cycle_time == args.display_time:
+        if cycle_time == args.display_time and not args.headless:
             env.draw_pyplot()
+    if args.strips == 1:
+        env.disable_metrics()
+        env.disable_tracing()
+        env.disable_population()
+    if frame_recorder is not None:
+        frame_recorder.close()
+    if replay_recorder is not None:
+        replay_recorder.close(env)
     # draw the final state
-    env.draw_pyplot()
+    if not args.headless:
+        env.draw_pyplot()
+    if args.strips > 1:
+        env.close()
 
 if __name__ == '__main__':
     main()
@@ -1,12 +1,24 @@
 import logging
-import matplotlib.pyplot as plt
 import numpy as np
+import checkpoint
+import metrics
 import plant
+import population
+import random_stream
+import renderer
+import steady_state
+import tracing
 
 
 class Environment(object):
     """
     Tracks each location in a 2D environment and defines the parameters of the environment.
+
+    The parameters are class attributes, and may be overridden for a single environment by setting an instance
+    attribute of the same name before the first step.
+
+    Every random decision is drawn from the environment's own RandomStream, rng, so a run is determined by its seed
+    alone.
     """
 
     given_energy_per_cycle = 40
@@ -17,13 +29,43 @@ class Environment(object):
     seed_spread = 20
     cell_life_span = 100
     include_diagonal_neighbors = True
+    mutation_probability = .1
+    mutation_addition_probability = .5
+    mutation_max_cell_additions = 5
+    mutation_max_cell_removals = 5
+    mutation_seed_probability = .1
+    verify_connectivity = False
+    batched_growth = False
+
+    def __init__(self, width, height, seed=None):
+        """
+        seed: seed of the environment's random number stream, or None for a different run every time
+        """
 
-    def __init__(self, width, height):
+        self.rng = random_stream.RandomStream(seed)
         self.plant_manager = plant.PlantManager(self)
         self.width = width
         self.height = height
         self.time = 0
-        self.cells = [[None] * height for y in range(width)]
+        self.cells = self._new_grid()  # cells[x][y] is the living cell at (x, y), or None
+        self.column_tops = np.full(width, -1, dtype=np.int32)  # y of the topmost cell in each column, or -1 if empty
+        self._damaged_plants = {}  # insertion-ordered set of plants that lost cells since the last connectivity check
+        # x * height + y -> the plant, or set of several plants, connected to and with pending cells at the location
+        self._growth_frontier = {}
+        self._expiring = {}  # time -> (x, y, creation time) of each cell that reaches the end of its life span then
+        self.metrics = None
+        self.tracer = None
+        self.population = None
+        self.state_hash = None
+        self.observers = []  # objects whose end_step(env) is called after each step, such as a FrameRecorder
+
+    def _new_grid(self):
+        """ Returns an empty grid of the width and height of the environment, indexed by x and then y. """
+        return [[None] * self.height for _ in range(self.width)]
+
+    def _occupied_columns(self):
+        """ Returns the x of every column that may hold a cell, in increasing order. """
+        return range(self.width)
 
     def __str__(self):
         return "Environment %d by %d with %d plants" % (self.width, self.height, self.plant_manager.living_count())
@@ -40,6 +82,187 @@ class Environment(object):
             return False
         return self.cells[x][y] is None
 
+    def place_cell(self, x, y, cell):
+        """ Records that the specified living cell now occupies location (x, y). """
+
+        self.cells[x][y] = cell
+        if y > self.column_tops[x]:
+            self.column_tops[x] = y
+        cell.plant.cell_placed(x, y)
+        expiry_time = cell.creation_time + self.cell_life_span + 1
+        expiring = self._expiring.get(expiry_time)
+        if expiring is None:
+            self._expiring[expiry_time] = [(x, y, cell.creation_time)]
+        else:
+            expiring.append((x, y, cell.creation_time))
+
+    def restore_cells(self, cells, xs, ys, plant_ids, creation_times):
+        """ Records that the specified living cells of a checkpoint occupy their locations, all at once and without
+        telling their plants, whose growth queues must be built afterwards.
+
+        xs, ys, plant_ids, creation_times: arrays of the location, plant id and creation time of each cell
+        """
+
+        grid = self.cells
+        for x, y, cell in zip(xs.tolist(), ys.tolist(), cells):
+            grid[x][y] = cell
+        np.maximum.at(self.column_tops, xs, ys)
+
+        # Each cell is scheduled to expire in the order given, as if the cells had been placed one by one
+        expiry_times = creation_times.astype(np.int64) + self.cell_life_span + 1
+        order = np.argsort(expiry_times, kind="stable")
+        times, starts = np.unique(expiry_times[order], return_index=True)
+        entries = list(zip(xs[order].tolist(), ys[order].tolist(), creation_times[order].tolist()))
+        for expiry_time, start, stop in zip(times.tolist(), starts.tolist(), starts[1:].tolist() + [len(entries)]):
+            self._expiring.setdefault(expiry_time, []).extend(entries[start:stop])
+
+    def remove_cell(self, x, y, cell):
+        """ Records that the specified cell died and no longer occupies location (x, y). """
+
+        self.cells[x][y] = None
+        if self.column_tops[x] == y:
+            # The new top of the column is the highest cell below the one that died
+            column = self.cells[x]
+            top = y - 1
+            while top >= 0 and column[top] is None:
+                top -= 1
+            self.column_tops[x] = top
+        self._damaged_plants[cell.plant] = None
+        self._location_freed(x, y)
+
+    def _location_freed(self, x, y):
+        """ Tells the plants that are connected to location (x, y) and have pending cells there that it is now free. """
+
+        location = x * self.height + y
+        waiting_plants = self._growth_frontier.get(location)
+        if waiting_plants is None:
+            return
+        if type(waiting_plants) is set:
+            for waiting_plant in list(waiting_plants):
+                if not waiting_plant.queue_pending_cells(x, y):
+                    waiting_plants.discard(waiting_plant)
+            self._shrink_growth_frontier(location, waiting_plants)
+        elif not waiting_plants.queue_pending_cells(x, y):
+            del self._growth_frontier[location]
+
+    def add_seedling(self, x, y, plant_genome):
+        """ Creates a new living plant with the specified genome whose root is at (x, y), and returns it. """
+
+        seedling = plant.Plant(self, x, y, plant_genome)
+        seedling.set_living(True)
+        return seedling
+
+    def join_growth_frontier(self, x, y, plant):
+        """ Records that the plant is connected to location (x, y) and has a pending cell there, so that it is told when
+        the location becomes free.
+        """
+
+        location = x * self.height + y
+        waiting_plants = self._growth_frontier.get(location)
+        if waiting_plants is None:
+            # Most locations only have one plant waiting, which is stored without a set to save memory
+            self._growth_frontier[location] = plant
+        elif type(waiting_plants) is set:
+            waiting_plants.add(plant)
+        elif waiting_plants is not plant:
+            self._growth_frontier[location] = set((waiting_plants, plant))
+
+    def leave_growth_frontier(self, x, y, plant):
+        """ Stops telling the plant when location (x, y) becomes free. """
+
+        location = x * self.height + y
+        waiting_plants = self._growth_frontier.get(location)
+        if waiting_plants is None:
+            return
+        if type(waiting_plants) is set:
+            waiting_plants.discard(plant)
+            self._shrink_growth_frontier(location, waiting_plants)
+        elif waiting_plants is plant:
+            del self._growth_frontier[location]
+
+    def _shrink_growth_frontier(self, location, waiting_plants):
+        """ Replaces the set of plants waiting at a location with the single plant, or nothing, left in it. """
+
+        if len(waiting_plants) == 1:
+            self._growth_frontier[location] = waiting_plants.pop()
+        elif not waiting_plants:
+            del self._growth_frontier[location]
+
+    def save(self, path, compressed=False):
+        """ Writes a checkpoint of the complete simulation state, including the random number generator, to path. """
+
+        checkpoint.save(self, path, compressed)
+
+    @classmethod
+    def load(cls, path):
+        """ Returns a new environment restored from the checkpoint at path.  The run continues exactly as it would have
+        if it had not been saved.
+        """
+
+        return checkpoint.load(cls, path)
+
+    def enable_metrics(self, path=None, interval=500):
+        """ Starts collecting per-phase timers and population counters, and returns the Metrics that holds them.
+
+        The Metrics, like the Tracer, PopulationRecorder and StateHash enabled below, only exists while it is enabled,
+        so a run without it pays a single None check per step and per event.
+
+        path: JSON lines file to which a record is appended every interval cycles, or None to keep them in memory
+        """
+
+        self.metrics = metrics.Metrics(path, interval)
+        return self.metrics
+
+    def disable_metrics(self):
+        """ Stops collecting metrics, writing out any partial interval. """
+
+        if self.metrics is not None:
+            self.metrics.close(self)
+            self.metrics = None
+
+    def enable_tracing(self, path=None, capacity=65536):
+        """ Starts recording cell, plant, seed and mutation events, and returns the Tracer that holds them.
+
+        path: file to which the events are written, or None to keep the most recent capacity events in memory
+        """
+
+        self.tracer = tracing.Tracer(path, capacity)
+        return self.tracer
+
+    def disable_tracing(self):
+        """ Stops recording events, writing out any that are buffered. """
+
+        if self.tracer is not None:
+            self.tracer.close()
+            self.tracer = None
+
+    def enable_population(self, path=None, block_size=4096):
+        """ Starts recording a per-cycle time series of the population and a lineage table of the seedlings, and returns
+        the PopulationRecorder that holds them.
+
+        path: file to which the tables are written in blocks of block_size rows, or None to keep them in memory
+        """
+
+        self.population = population.PopulationRecorder(self, path, block_size)
+        return self.population
+
+    def disable_population(self):
+        """ Stops recording the population, writing out any partial blocks. """
+
+        if self.population is not None:
+            self.population.close()
+            self.population = None
+
+    def enable_state_hash(self, seed=0):
+        """ Starts maintaining a hash of the configuration of cells and plants, and returns the StateHash. """
+
+        self.state_hash = steady_state.StateHash(self, seed)
+        return self.state_hash
+
+    def disable_state_hash(self):
+        """ Stops maintaining the hash of the configuration. """
+        self.state_hash = None
+
     def complete_death(self):
         """Returns boolean of whether all plants in the environment are dead. """
 
@@ -54,64 +277,200 @@ class Environment(object):
         :return: None
         """
 
+        self._run_phases(self.phases())
+        self._end_step()
+
+    def _run_phases(self, phases):
+        """ Runs the (name, function) pairs of phases of a step in time, timing them if metrics are enabled. """
+
         if self.time % 500 == 0:
             logging.info("Cycle %d living count: %d" % (self.time, self.plant_manager.living_count()))
-        self._give_energy()
-        self._take_energy()
-        self._enforce_life_span()
-        self.plant_manager.grow_all_plants()
-        self._kill_disconnected_cells()
-        self.plant_manager.prune_plants()
+        if self.metrics is None:
+            for _, phase in phases:
+                phase()
+        else:
+            self.metrics.run_phases(self, phases)
+
+    def _end_step(self):
+        """ Advances the time once the phases of a step have run, and lets the metrics and observers see the result. """
+
         self.time += 1
+        if self.metrics is not None:
+            self.metrics.end_step(self)
+        if self.population is not None:
+            self.population.end_step(self)
+        for observer in self.observers:
+            observer.end_step(self)
+
+    def phases(self):
+        """ Returns a list of (name, function) pairs for the phases of a step in time, in the order they run in. """
+
+        return [("give_energy", self._give_energy),
+                ("take_energy", self._take_energy),
+                ("life_span", self._enforce_life_span),
+                ("grow", self.plant_manager.grow_all_plants_batched if self.batched_growth else
+                 self.plant_manager.grow_all_plants),
+                ("kill_disconnected", self._kill_disconnected_cells),
+                ("prune", self.plant_manager.prune_plants)]
 
     def _give_energy(self):
         """ Gives energy to the topmost cell in each column. """
 
-        for x in range(self.width):
-            for y in reversed(range(self.height)):
-                cell = self.cells[x][y]
-                if cell is not None:
-                    cell.plant.increment_energy(Environment.given_energy_per_cycle)
-                    break
+        cells = self.cells
+        columns = np.flatnonzero(self.column_tops >= 0)
+        plant_ids = np.fromiter((cells[x][y].plant.id for x, y in zip(columns.tolist(),
+                                                                    self.column_tops[columns].tolist())),
+                                dtype=np.int64, count=len(columns))
+        self._give_energy_for(np.bincount(plant_ids, minlength=self.plant_manager.registry.capacity()))
+
+    def _give_energy_for(self, counts):
+        """ Gives each plant energy for the number of columns in which it has the topmost cell, counts[id]. """
+
+        # Only a plant that is already dead can have negative energy here, so giving energy cannot kill any plant
+        self.plant_manager.registry.energy += counts * self.given_energy_per_cycle
 
     def _take_energy(self):
-        """ Takes energy from each plant for each cell that the plan has which is alive. """
+        """ Takes energy from each plant for each cell that the plan has which is alive.
 
-        for x in range(self.width):
-            for y in reversed(range(self.height)):
-                cell = self.cells[x][y]
-                if cell is not None:
-                    cell.plant.increment_energy(-Environment.taken_energy_per_cycle)
+        Plants that can pay for all of their cells are charged at once, with a single scatter-add into the registry's
+        energy array.  A living plant that runs out of energy part way through is charged cell by cell, in column-major
+        order from the top of each column, so that the energy it is left with and any cells that outlive it are the
+        same as if every cell were charged in turn.
+        """
+
+        cells = self.cells
+        plant_ids = np.fromiter((cell.plant.id for x in self._occupied_columns() for cell in cells[x]
+                                 if cell is not None), dtype=np.int64)
+        self._take_energy_for(np.bincount(plant_ids, minlength=self.plant_manager.registry.capacity()))
+
+    def _take_energy_for(self, counts):
+        """ Takes energy from each plant for its counts[id] living cells, as described in _take_energy. """
+
+        registry = self.plant_manager.registry
+        cost = self.taken_energy_per_cycle
+        charges = counts * cost
+        dying = registry.alive & (registry.energy < charges)
+        registry.energy -= np.where(dying, 0, charges)
+        if not dying.any():
+            return
+
+        for x, y in self._cell_locations_of(dying):
+            cell = self.cells[x][y]
+            if cell is not None:
+                cell.plant.increment_energy(-cost)
+
+    def _cell_locations_of(self, selected):
+        """ Returns a list of the (x, y) of every living cell of the plants whose ids are selected, in column-major
+        order from the top of each column.
+        """
+
+        locations = []
+        for plant_id in np.flatnonzero(selected).tolist():
+            plant = self.plant_manager.registry.plants[plant_id]
+            for cell in plant.living_cells:
+                locations.append((plant.root_x + cell.dx, plant.root_y + cell.dy))
+        locations.sort(key=lambda location: (location[0], -location[1]))
+        return locations
 
     def _enforce_life_span(self):
-        """ Kills all cells that have exceeded the lifespan as defined by cell_life_span"""
+        """ Kills all cells that have exceeded the lifespan as defined by cell_life_span
 
-        for x in range(self.width):
-            for y in reversed(range(self.height)):
-                cell = self.cells[x][y]
-                if cell is not None:
-                    if self.time - cell.creation_time > Environment.cell_life_span:
-                        cell.set_living(False)
+        Each cell is scheduled to expire when it is placed, using the cell_life_span at that time, so only the cells
+        scheduled for this cycle are visited.  The schedule holds the location and creation time rather than the cell,
+        so that a cell that has already died some other way (and its plant) is not kept in memory until then.  Such a
+        cell is skipped, since no other cell can come to life at its location at the same time.
+        """
+
+        killed_count = 0
+        for x, y, creation_time in self._expiring.pop(self.time, ()):
+            cell = self.cells[x][y]
+            if cell is not None and cell.creation_time == creation_time:
+                cell.set_living(False, tracing.LIFE_SPAN)
+                killed_count += 1
+        if self.metrics is not None:
+            self.metrics.cells_killed_life_span += killed_count
 
     def _kill_disconnected_cells(self):
         """
-        Uses a depth first search to determine which cells are not connected to the ground (y=0), and then kills any cells
-        that are not connected.  A neighbor is defined as any of the four cells that are left, right, above, or below.
+        Kills any cells that are not connected to the ground (y=0) through other cells of the same plant.  A neighbor is
+        defined as any of the four cells that are left, right, above, or below (plus the four diagonals when
+        include_diagonal_neighbors is set).
+
+        A cell can only become disconnected when another cell of the same plant dies, so only the plants that have lost
+        cells since the last check are searched, and a cycle in which no cells died does no work.  When
+        verify_connectivity is set, the result is checked against a depth first search of the whole grid.
         """
 
-        if Environment.include_diagonal_neighbors:
-            neighbor_list = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (1, -1), (-1, 1), (1, 1)]  # 8 neighbors
-        else:
-            neighbor_list = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+        if not self._damaged_plants and not self.verify_connectivity:
+            return
+
+        disconnected = []
+        for damaged_plant in self._damaged_plants:
+            disconnected.extend(self._find_disconnected_cells(damaged_plant))
+        if self.verify_connectivity:
+            expected = self._find_disconnected_cells_by_full_search()
+            if set(disconnected) != expected:
+                raise Exception("Incremental connectivity found %d disconnected cells but a full search found %d" %
+                                (len(disconnected), len(expected)))
+
+        for cell in disconnected:
+            cell.set_living(False, tracing.DISCONNECTED)
+        if self.metrics is not None:
+            self.metrics.cells_killed_disconnected += len(disconnected)
+        # Killing disconnected cells cannot disconnect any others, so every plant is now fully connected
+        self._damaged_plants.clear()
+
+    def _neighbor_list(self):
+        """ Returns the (dx, dy) offsets of the neighbors through which cells of a plant are connected. """
+
+        if self.include_diagonal_neighbors:
+            return [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (1, -1), (-1, 1), (1, 1)]  # 8 neighbors
+        return [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+    def _find_disconnected_cells(self, plant):
+        """ Uses a depth first search from the plant's cells on the ground to find which of its living cells are not
+        connected to the ground, and returns them as a list.
+        """
+
+        neighbor_list = self._neighbor_list()
+        pending_exploration = []
+        # Mark all of the plant's cells on ground level as connected and add them to pending queue
+        for cell in plant.living_cells:
+            if plant.root_y + cell.dy == 0:
+                cell.connected_time = self.time
+                pending_exploration.append(cell)
+        # Keep exploring neighbors until the queue is empty
+        while pending_exploration:
+            cell = pending_exploration.pop()
+            x = plant.root_x + cell.dx
+            y = plant.root_y + cell.dy
+            for dx, dy in neighbor_list:
+                neighbor_x = x + dx
+                neighbor_y = y + dy
+                if not self.valid_coords(neighbor_x, neighbor_y):
+                    continue
+                neighbor_cell = self.cells[neighbor_x][neighbor_y]
+                if neighbor_cell is None:
+                    continue
+                if neighbor_cell.plant is plant and neighbor_cell.connected_time != self.time:
+                    neighbor_cell.connected_time = self.time
+                    pending_exploration.append(neighbor_cell)
+        # Any cells that were not marked with the most recent time are disconnected
+        return [cell for cell in plant.living_cells if cell.connected_time != self.time]
+
+    def _find_disconnected_cells_by_full_search(self):
+        """ Uses a depth first search of the whole grid, starting from every cell on the ground, to find the set of
+        cells that are not connected to the ground.  This is the reference for _find_disconnected_cells.
+        """
 
+        neighbor_list = self._neighbor_list()
+        connected = set()
         pending_exploration = []
-        # Mark all cells on ground level as connected and add them to pending queue
-        for x in range(self.width):
+        for x in self._occupied_columns():
             cell = self.cells[x][0]
             if cell is not None:
                 pending_exploration.append((x, 0))
-                cell.connected_time = self.time
-        # Keep exploring neighbors until the queue is empty
+                connected.add(cell)
         while pending_exploration:
             x, y = pending_exploration.pop()
             cell = self.cells[x][y]
@@ -123,18 +482,16 @@ class Environment(object):
                 neighbor_cell = self.cells[neighbor_x][neighbor_y]
                 if neighbor_cell is None:
                     continue
-                if neighbor_cell.plant is cell.plant and neighbor_cell.connected_time is not self.time:
-                    neighbor_cell.connected_time = self.time
+                if neighbor_cell.plant is cell.plant and neighbor_cell not in connected:
+                    connected.add(neighbor_cell)
                     pending_exploration.append((neighbor_x, neighbor_y))
-        # Kill any cells that were not marked with the most recent time
-        for x in range(self.width):
+        disconnected = set()
+        for x in self._occupied_columns():
             for y in range(self.height):
                 cell = self.cells[x][y]
-                if cell is None:
-                    continue
-                if cell.connected_time is not self.time:
-                    logging.debug("Killing disconnected Cell (%d, %d) time: %d" % (x, y, cell.creation_time))
-                    cell.set_living(False)
+                if cell is not None and cell not in connected:
+                    disconnected.add(cell)
+        return disconnected
 
     def connected(self, x, y, plant):
         """ returns boolean indicating whether the specified location in the environment is adjacent (i.e. connected) to
@@ -153,19 +510,46 @@ class Environment(object):
                 return True
         return False
 
-    def draw_pyplot(self):
-        """ Displays a pyplot of the current state of the environment.  Each plan is given a semi-random color when it is
-        created."""
+    def canopy_profile(self, start=0, stop=None):
+        """ Returns an array of the height of the vegetation in each column from start up to stop, which is one more
+        than the y of its topmost cell, or 0 if the column is empty.
+        """
+        return self.column_tops[start:stop] + 1
+
+    def canopy_plant_ids(self, start=0, stop=None):
+        """ Returns an array of the registry id of the plant that owns the topmost cell, and so receives the sunlight,
+        of each column from start up to stop, or -1 if the column is empty.
+        """
+
+        tops = self.column_tops[start:stop]
+        plant_ids = np.full(len(tops), -1, dtype=np.int32)
+        first_x = range(self.width)[start:stop].start
+        for column in np.flatnonzero(tops >= 0).tolist():
+            plant_ids[column] = self.cells[first_x + column][tops[column]].plant.id
+        return plant_ids
+
+    def plant_id_grid(self):
+        """ Returns a (width, height) array of the registry id of the plant occupying each location, or -1 if empty. """
 
-        env_rgb = np.zeros((self.width, self.height, 3), dtype=np.uint8)
-        for x in range(self.width):
+        plant_ids = np.full((self.width, self.height), -1, dtype=np.int32)
+        for x in self._occupied_columns():
             for y in range(self.height):
-                cell = self.cells[x][self.height - 1 - y]
+                cell = self.cells[x][y]
                 if cell is not None:
-                    logging.debug("Adding colored cell")
-                    env_rgb[x, y, 0] = cell.plant.r
-                    env_rgb[x, y, 1] = cell.plant.g
-                    env_rgb[x, y, 2] = cell.plant.b
+                    plant_ids[x, y] = cell.plant.id
+        return plant_ids
+
+    def frame(self):
+        """ Returns an RGB image of the current state of the environment, as drawn by renderer.frame. """
+        return renderer.frame(self)
+
+    def draw_pyplot(self):
+        """ Displays a pyplot of the current state of the environment.  Each plan is given a semi-random color when it is
+        created.
+
+        matplotlib is only imported when this is called, so headless runs never load it.
+        """
 
-        plt.imshow(env_rgb.transpose((1, 0, 2)))
+        import matplotlib.pyplot as plt
+        plt.imshow(self.frame())
         plt.show()
@@ -0,0 +1,58 @@
+import weakref
+
+
+class Genome(object):
+    """ The ordered list of cells that a plant tries to grow, each an entry of (dx, dy, seed) relative to its root.
+
+    Genomes are immutable and interned, so every plant with the same list of cells shares a single Genome and two
+    genomes are equal only if they are the same object.  A mutation produces a new interned genome rather than changing
+    an existing one.  Genomes are only created through Genome.intern.
+    """
+
+    __slots__ = ("entries", "locations", "seed_count", "__weakref__")
+    _interned = weakref.WeakValueDictionary()
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.locations = {}  # (dx, dy) -> indices of the entries at that location, in increasing order
+        for index, (dx, dy, _) in enumerate(entries):
+            self.locations[(dx, dy)] = self.locations.get((dx, dy), ()) + (index,)
+        self.seed_count = sum(1 for _, _, seed in entries if seed)
+
+    @staticmethod
+    def intern(entries):
+        """ Returns the one Genome with the specified sequence of (dx, dy, seed) entries. """
+
+        entries = tuple((dx, dy, bool(seed)) for dx, dy, seed in entries)
+        genome = Genome._interned.get(entries)
+        if genome is None:
+            genome = Genome(entries)
+            Genome._interned[entries] = genome
+        return genome
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    def __reduce__(self):
+        return Genome.intern, (self.entries,)
+
+    def appended(self, entries):
+        """ Returns the genome with the specified entries added to the end. """
+
+        return Genome.intern(self.entries + tuple(entries))
+
+    def inserted(self, index, entry):
+        """ Returns the genome with the specified entry inserted before index. """
+
+        return Genome.intern(self.entries[:index] + (entry,) + self.entries[index:])
+
+    def removed(self, index):
+        """ Returns the genome without the entry at index. """
+
+        return Genome.intern(self.entries[:index] + self.entries[index + 1:])
+
+
+empty = Genome.intern(())
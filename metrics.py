@@ -0,0 +1,91 @@
+import json
+import time
+
+
+class Metrics(object):
+    """ Per-phase timers, population counters, and phase hooks for one environment.
+
+    The counters and timers accumulate over an interval of cycles.  At the end of each interval a record of them is
+    appended as one JSON line to the sink (if there is one) and they are reset.
+    """
+
+    counter_names = ["cells_born", "cells_killed_life_span", "cells_killed_energy", "cells_killed_disconnected",
+                     "seeds_attempted", "seeds_landed", "plants_pruned"]
+
+    def __init__(self, path=None, interval=500):
+        """
+        path: JSON lines file to which records are appended, or None to only keep the counters in memory
+        interval: number of cycles covered by each record
+        """
+
+        self.interval = interval
+        self._sink = open(path, "a") if path else None
+        self._before_phase_hooks = []
+        self._after_phase_hooks = []
+        self.reset()
+
+    def reset(self):
+        """ Clears the counters and timers to start a new interval. """
+
+        for name in Metrics.counter_names:
+            setattr(self, name, 0)
+        self.phase_seconds = {}
+        self.cycles = 0
+
+    def add_hooks(self, before=None, after=None):
+        """ Registers functions to call before and/or after each phase.  Each is called as hook(env, phase_name). """
+
+        if before is not None:
+            self._before_phase_hooks.append(before)
+        if after is not None:
+            self._after_phase_hooks.append(after)
+
+    def run_phases(self, env, phases):
+        """ Runs each of the (name, function) pairs of phases of a step in time, timing it and calling the hooks around
+        it.
+        """
+
+        for name, phase in phases:
+            for hook in self._before_phase_hooks:
+                hook(env, name)
+            start = time.perf_counter()
+            phase()
+            self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + time.perf_counter() - start
+            for hook in self._after_phase_hooks:
+                hook(env, name)
+
+    def end_step(self, env):
+        """ Counts a completed step and writes a record to the sink when the interval is complete. """
+
+        self.cycles += 1
+        if env.time % self.interval == 0:
+            self.flush(env)
+
+    def record(self, env):
+        """ Returns a dictionary of the counters and timers accumulated so far in this interval. """
+
+        record = {"time": env.time,
+                  "cycles": self.cycles,
+                  "living_plants": env.plant_manager.living_count(),
+                  "births": env.plant_manager.birth_count,
+                  "deaths": env.plant_manager.death_count,
+                  "phase_seconds": self.phase_seconds}
+        for name in Metrics.counter_names:
+            record[name] = getattr(self, name)
+        return record
+
+    def flush(self, env):
+        """ Writes a record of the current interval to the sink and starts a new interval. """
+
+        if self._sink is not None and self.cycles:
+            self._sink.write(json.dumps(self.record(env), sort_keys=True) + "\n")
+            self._sink.flush()
+        self.reset()
+
+    def close(self, env):
+        """ Writes any partial interval and closes the sink. """
+
+        self.flush(env)
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
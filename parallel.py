@@ -0,0 +1,315 @@
+import logging
+import multiprocessing
+import numpy as np
+import array_environment
+import random_stream
+import tracing
+
+
+class StripEnvironment(array_environment.ArrayEnvironment):
+    """
+    One column strip of a ParallelEnvironment, simulated by its own worker process.
+
+    The strip owns the plants whose roots are in its columns.  It holds them in a window that extends halo columns past
+    each side of its own columns, so that their cells can grow and their seeds can land across the boundary.  Cells of
+    other strips' plants that are inside the window are held as ghosts, which take up space but belong to no plant
+    here.  Coordinates inside a strip are relative to the left edge of its window.
+
+    Each ghost is identified by a key of creation_time * strip_count + strip_index, which orders cells by age and then
+    by strip.  When a cell of this strip and a ghost were grown into the same location in the same cycle, the one with
+    the smaller key survives, and both strips reach that decision independently.  Each strip remembers the keys it last
+    sent to, and received from, every other strip, so only the locations whose keys changed are exchanged.
+    """
+
+    empty_ghost = np.iinfo(np.int64).max
+
+    def __init__(self, strip_index, windows, owned_columns, height, seed=None):
+        """
+        windows: the (start, stop) global columns of the window of every strip
+        owned_columns: the (start, stop) global columns that every strip owns
+        """
+
+        window_start, window_stop = windows[strip_index]
+        super(StripEnvironment, self).__init__(window_stop - window_start, height, seed)
+        self.strip_index = strip_index
+        self.strip_count = len(windows)
+        self.offset = window_start
+        self.owned_columns = owned_columns
+        self.owned_start = owned_columns[strip_index][0] - window_start
+        self.owned_stop = owned_columns[strip_index][1] - window_start
+        self.shared_columns = {}  # strip index -> (start, stop) local columns that are also in that strip's window
+        for other_index, (other_start, other_stop) in enumerate(windows):
+            if other_index != strip_index and other_start < window_stop and window_start < other_stop:
+                self.shared_columns[other_index] = (max(window_start, other_start) - window_start,
+                                                    min(window_stop, other_stop) - window_start)
+        self.ghost_keys = np.full((self.width, height), StripEnvironment.empty_ghost, dtype=np.int64)
+        # strip index -> keys of the cells in the shared columns, as last sent to and received from that strip
+        self._sent_keys = {}
+        self._received_keys = {}
+        for other_index, (start, stop) in self.shared_columns.items():
+            self._sent_keys[other_index] = np.full((stop - start, height), StripEnvironment.empty_ghost, dtype=np.int64)
+            self._received_keys[other_index] = self._sent_keys[other_index].copy()
+        self._outgoing_credits = dict((other_index, []) for other_index in self.shared_columns)
+        self._outgoing_seeds = dict((other_index, []) for other_index in self.shared_columns)
+
+    def is_space_available(self, x, y):
+        """ Returns whether or not the coordinates are a valid location to grow a new cell. """
+
+        return super(StripEnvironment, self).is_space_available(x, y) and \
+            self.ghost_keys[x, y] == StripEnvironment.empty_ghost
+
+    def add_seedling(self, x, y, plant_genome):
+        """ Creates a new living plant if x is one of this strip's own columns, and otherwise sends it to the strip that
+        owns the column.
+
+        :return: the new plant, or None if it was sent to another strip
+        """
+
+        if self.owned_start <= x < self.owned_stop:
+            return super(StripEnvironment, self).add_seedling(x, y, plant_genome)
+        global_x = x + self.offset
+        for other_index in self.shared_columns:
+            owned_start, owned_stop = self.owned_columns[other_index]
+            if owned_start <= global_x < owned_stop:
+                self._outgoing_seeds[other_index].append((global_x, y, plant_genome))
+        return None
+
+    def _give_energy(self):
+        """ Gives energy to the topmost cell in each of this strip's own columns.
+
+        When the topmost cell is a ghost, the energy is sent to the strip that owns it.
+        """
+
+        registry = self.plant_manager.registry
+        own_ids = self.plant_ids[self.owned_start:self.owned_stop]
+        ghost_keys = self.ghost_keys[self.owned_start:self.owned_stop]
+        occupied_from_top = ((own_ids >= 0) | (ghost_keys != StripEnvironment.empty_ghost))[:, ::-1]
+        depths = np.argmax(occupied_from_top, axis=1)
+        columns = np.flatnonzero(occupied_from_top[np.arange(len(own_ids)), depths])
+        tops = self.height - 1 - depths[columns]
+        top_ids = own_ids[columns, tops]
+        mine = top_ids >= 0
+        registry.energy += np.bincount(top_ids[mine], minlength=registry.capacity()) * self.given_energy_per_cycle
+
+        xs = columns[~mine] + self.owned_start
+        ys = tops[~mine]
+        for x, y, key in zip(xs.tolist(), ys.tolist(), self.ghost_keys[xs, ys].tolist()):
+            self._outgoing_credits[key % self.strip_count].append((x + self.offset, y, key,
+                                                                   self.given_energy_per_cycle))
+
+    def receive(self, ghosts, credits, seeds):
+        """ Applies what the other strips sent at the end of the last step.
+
+        ghosts: list of (strip index, xs, ys, keys) of the locations inside this window whose keys changed in another
+        strip, where the key is empty_ghost if the location is now empty
+        credits: list of (x, y, key, energy) for sunlight that fell on this strip's cells in other strips' columns
+        seeds: list of (x, y, genome) for seedlings that landed in this strip's columns
+        """
+
+        changed = [np.zeros(0, dtype=np.intp)]
+        for other_index, ghost_xs, ghost_ys, keys in ghosts:
+            xs = ghost_xs - self.offset
+            self._received_keys[other_index][xs - self.shared_columns[other_index][0], ghost_ys] = keys
+            changed.append(xs * self.height + ghost_ys)
+        xs, ys = np.divmod(np.unique(np.concatenate(changed)), self.height)
+        previous_keys = self.ghost_keys[xs, ys]
+        keys = np.full(len(xs), StripEnvironment.empty_ghost, dtype=np.int64)
+        for other_index, (start, stop) in self.shared_columns.items():
+            inside = (xs >= start) & (xs < stop)
+            keys[inside] = np.minimum(keys[inside], self._received_keys[other_index][xs[inside] - start, ys[inside]])
+        self.ghost_keys[xs, ys] = keys
+
+        # Cells of this strip that lost a location to an older ghost, or to one of a lower strip grown at the same time.
+        # A cell never grows where there is already a ghost, so only ghosts that just arrived can win.
+        own_keys = self.creation_times[xs, ys].astype(np.int64) * self.strip_count + self.strip_index
+        lost = (self.plant_ids[xs, ys] >= 0) & (keys < own_keys)
+        for x, y in zip(xs[lost].tolist(), ys[lost].tolist()):
+            cell = self.cells[x][y]
+            if cell is not None:
+                cell.set_living(False, tracing.CROWDED)
+
+        freed = (previous_keys != StripEnvironment.empty_ghost) & (keys == StripEnvironment.empty_ghost) & \
+                (self.plant_ids[xs, ys] < 0)
+        for x, y in zip(xs[freed].tolist(), ys[freed].tolist()):
+            self._location_freed(x, y)
+
+        for x, y, key, energy in credits:
+            cell = self.cells[x - self.offset][y]
+            if cell is not None and cell.creation_time * self.strip_count + self.strip_index == key:
+                cell.plant.increment_energy(energy)
+
+        for x, y, plant_genome in seeds:
+            if self.is_space_available(x - self.offset, y):
+                self.add_seedling(x - self.offset, y, plant_genome)
+
+    def send(self):
+        """ Returns what this strip sends to the other strips after a step, as a dictionary of strip index to
+        (ghosts, credits, seeds) in the form taken by receive.
+        """
+
+        messages = {}
+        for other_index, (start, stop) in self.shared_columns.items():
+            keys = np.where(self.plant_ids[start:stop] >= 0,
+                            self.creation_times[start:stop].astype(np.int64) * self.strip_count + self.strip_index,
+                            StripEnvironment.empty_ghost)
+            sent_keys = self._sent_keys[other_index]
+            xs, ys = np.nonzero(keys != sent_keys)
+            changed_keys = keys[xs, ys]
+            sent_keys[xs, ys] = changed_keys
+            messages[other_index] = ((self.strip_index, xs + start + self.offset, ys, changed_keys),
+                                     self._outgoing_credits[other_index], self._outgoing_seeds[other_index])
+            self._outgoing_credits[other_index] = []
+            self._outgoing_seeds[other_index] = []
+        return messages
+
+
+def _run_strip(connection, strip_index, windows, owned_columns, height, seed, parameters):
+    """ Simulates one strip of a ParallelEnvironment, carrying out the commands received over connection until it is
+    told to close.
+    """
+
+    logging.disable(logging.INFO)  # the ParallelEnvironment reports progress for the whole world
+    env = StripEnvironment(strip_index, windows, owned_columns, height, seed)
+    for name, value in parameters.items():
+        setattr(env, name, value)
+    while True:
+        command, argument = connection.recv()
+        if command == "plant":
+            for x in argument:
+                env.plant_manager.basic_plant(env, env.energy_in_new_plant, x - env.offset, 2, 1)
+            connection.send((env.plant_manager.living_count(), env.send()))
+        elif command == "step":
+            env.receive(*argument)
+            env.step_time()
+            connection.send((env.plant_manager.living_count(), env.send()))
+        elif command == "frame":
+            connection.send((env.offset, env.frame(), (env.plant_ids >= 0)[:, ::-1].T))
+        elif command == "close":
+            connection.close()
+            return
+
+
+class ParallelEnvironment(object):
+    """
+    A wide world split into column strips that are simulated in parallel, each by a StripEnvironment in its own worker
+    process.
+
+    In each step every strip steps its own plants independently, and then sends the others the changes to its cells that
+    are inside their windows, the sunlight that fell on their cells in its columns, and the seedlings that landed in
+    their columns.  These are applied at the start of the next step, so interactions across a boundary lag by one
+    cycle.  The results therefore differ from those of a single Environment, but are identical between runs with the
+    same seed, strip count and halo.
+
+    A plant cannot grow or seed more than halo columns past the edge of its strip, so halo should exceed seed_spread
+    plus how far genomes reach sideways from their roots.
+    """
+
+    def __init__(self, width, height, strip_count, seed=None, halo=32, parameters=None):
+        """
+        seed: seed from which each strip's random seed is derived, or None for a different run every time
+        parameters: dictionary of Environment parameters overridden in every strip
+        """
+
+        if not 1 <= strip_count <= width:
+            raise ValueError("Cannot split %d columns into %d strips" % (width, strip_count))
+        self.width = width
+        self.height = height
+        self.time = 0
+        self.observers = []
+        self.owned_columns = [(index * width // strip_count, (index + 1) * width // strip_count)
+                              for index in range(strip_count)]
+        windows = [(max(0, start - halo), min(width, stop + halo)) for start, stop in self.owned_columns]
+        self._connections = []
+        self._processes = []
+        for strip_index, strip_seed in enumerate(random_stream.run_seeds(seed, strip_count)):
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_run_strip,
+                                              args=(worker_connection, strip_index, windows, self.owned_columns,
+                                                    height, strip_seed, parameters or {}))
+            process.daemon = True
+            process.start()
+            self._connections.append(connection)
+            self._processes.append(process)
+        self._living_counts = [0] * strip_count
+        self._inbound = [([], [], []) for _ in range(strip_count)]
+
+    def __str__(self):
+        return "ParallelEnvironment %d by %d in %d strips with %d plants" % (self.width, self.height,
+                                                                            len(self._connections), self.living_count())
+
+    def basic_plants(self, count):
+        """ Creates count basic plants which are spread evenly across the width of the world. """
+
+        roots = [[] for _ in self._connections]
+        for x in range(count):
+            root_x = (x + 1) * self.width // (count + 1)
+            for strip_index, (start, stop) in enumerate(self.owned_columns):
+                if start <= root_x < stop:
+                    roots[strip_index].append(root_x)
+        for connection, strip_roots in zip(self._connections, roots):
+            connection.send(("plant", strip_roots))
+        self._exchange()
+
+    def living_count(self):
+        """ Returns number of plants that are currently alive in all strips. """
+        return sum(self._living_counts)
+
+    def complete_death(self):
+        """Returns boolean of whether all plants in the world are dead and no seedlings are on their way to a strip. """
+
+        return self.living_count() == 0 and not any(seeds for _, _, seeds in self._inbound)
+
+    def step_time(self):
+        """ Steps every strip once in parallel and exchanges what crosses the boundaries between them. """
+
+        if self.time % 500 == 0:
+            logging.info("Cycle %d living count: %d" % (self.time, self.living_count()))
+        for connection, inbound in zip(self._connections, self._inbound):
+            connection.send(("step", inbound))
+        self._exchange()
+        self.time += 1
+        for observer in self.observers:
+            observer.end_step(self)
+
+    def _exchange(self):
+        """ Collects each strip's reply and routes its messages, in strip order so that runs are reproducible. """
+
+        self._inbound = [([], [], []) for _ in self._connections]
+        for strip_index, connection in enumerate(self._connections):
+            self._living_counts[strip_index], messages = connection.recv()
+            for other_index in sorted(messages):
+                ghosts, credits, seeds = messages[other_index]
+                if len(ghosts[1]):
+                    self._inbound[other_index][0].append(ghosts)
+                self._inbound[other_index][1].extend(credits)
+                self._inbound[other_index][2].extend(seeds)
+
+    def frame(self):
+        """ Returns an RGB image of the whole world as a (height, width, 3) uint8 array with the top of the world in row
+        0.
+        """
+
+        for connection in self._connections:
+            connection.send(("frame", None))
+        image = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        for connection in self._connections:
+            offset, strip_image, occupied = connection.recv()
+            window = image[:, offset:offset + strip_image.shape[1]]
+            window[occupied] = strip_image[occupied]
+        return image
+
+    def draw_pyplot(self):
+        """ Displays a pyplot of the current state of the whole world. """
+
+        import matplotlib.pyplot as plt
+        plt.imshow(self.frame())
+        plt.show()
+
+    def close(self):
+        """ Stops the worker processes. """
+
+        for connection in self._connections:
+            connection.send(("close", None))
+            connection.close()
+        for process in self._processes:
+            process.join()
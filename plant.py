@@ -1,7 +1,9 @@
-import random
-import logging
-import environment as e
+import heapq
+import numpy as np
 import cell as c
+import genome
+import registry
+import tracing
 
 
 class PlantManager(object):
@@ -14,9 +16,9 @@ class PlantManager(object):
         self.env = environment
         self.birth_count = 0
         self.death_count = 0
-        self.plants = []
+        self.plants = []  # tracked plants in the order in which they grow
+        self.registry = registry.PlantRegistry()
         self._new_plants = []
-        self._dead_plants = []
 
     def grow_all_plants(self):
         """ Performs growth ofor each living plant that is able to grow.
@@ -28,6 +30,51 @@ class PlantManager(object):
         self.plants.extend(self._new_plants)
         del self._new_plants[:]
 
+    def grow_all_plants_batched(self):
+        """ Grows every plant at once, so that the result does not depend on the order of the plants.
+
+        Each plant that can afford to grow takes the entry that it would grow if it were the only plant growing this
+        cycle.  When several plants take the same location, the one with the smallest growth_rank wins and the others
+        queue their entries again and do not grow this cycle.  The winners' cells are then grown in order of location,
+        and finally the seeds are grown, and reproduce, in order of location.
+
+        :return: None
+        """
+
+        growing = np.flatnonzero(self.registry.in_use & (self.registry.energy >= self.env.energy_per_cell))
+        new_plants = set(self._new_plants)
+        claims = {}  # (x, y) -> (plant, index) of the plant that is winning the location
+        root_xs = self.registry.root_x.tolist()
+        for plant_id in growing.tolist():
+            plant = self.registry.plants[plant_id]
+            if not plant._growth_queue or plant in new_plants:
+                continue
+            index = plant.take_growth_candidate()
+            if index is None:
+                continue
+            dx, dy, _ = plant.genome.entries[index]
+            location = (root_xs[plant_id] + dx, plant.root_y + dy)
+            rival = claims.get(location)
+            if rival is None:
+                claims[location] = (plant, index)
+            elif plant.growth_rank() < rival[0].growth_rank():
+                rival[0].return_growth_candidate(rival[1])
+                claims[location] = (plant, index)
+            else:
+                plant.return_growth_candidate(index)
+
+        seeds = []
+        for location in sorted(claims):
+            plant, index = claims[location]
+            if plant.genome.entries[index][2]:
+                seeds.append((plant, index))
+            else:
+                plant.grow_entry(index)
+        for plant, index in seeds:
+            plant.grow_entry(index)
+        self.plants.extend(self._new_plants)
+        del self._new_plants[:]
+
     def add_new_plant(self, new_plant):
         """ Adds the specified plan so that it is properly tracked. """
         self._new_plants.append(new_plant)
@@ -35,18 +82,43 @@ class PlantManager(object):
     def prune_plants(self):
         """ Fully removes any plant that has no living cells. """
 
+        remaining_plants = []
+        pruned_count = 0
         for plant in self.plants:
             if plant.living_cell_count == 0:
-                logging.debug("Killing plant with no living cells")
                 plant.set_living(False)
-                self._dead_plants.append(plant)
-        self.plants = [p for p in self.plants if p not in self._dead_plants]
-        del self._dead_plants[:]
+                plant.leave_growth_frontier()
+                self.registry.remove(plant.id)
+                plant.id = None
+                pruned_count += 1
+                if self.env.population is not None:
+                    self.env.population.plant_pruned(plant)
+            else:
+                remaining_plants.append(plant)
+        self.plants = remaining_plants
+        if self.env.metrics is not None:
+            self.env.metrics.plants_pruned += pruned_count
+
+    def genome_frequencies(self):
+        """ Returns a dictionary of the number of living plants that have each genome. """
+
+        frequencies = {}
+        for plant in self.plants:
+            if plant.is_alive():
+                frequencies[plant.genome] = frequencies.get(plant.genome, 0) + 1
+        return frequencies
 
     def living_count(self):
         """ Returns number of plants that are currently alive. """
         return self.birth_count - self.death_count
 
+    def basic_plants(self, environment, count):
+        """ Creates count basic plants which are spread evenly across the width of the environment. """
+
+        for x in range(count):
+            root_x = (x + 1) * environment.width // (count + 1)
+            self.basic_plant(environment, environment.energy_in_new_plant, root_x, 2, 1)
+
     def basic_plant(self, environment, energy, root_x, width=1, height=1):
         """ Creates a simple plant as the starting point of all other plants.
 
@@ -66,40 +138,99 @@ class PlantManager(object):
 
 
 class Plant(object):
-    """ A plant that contains a list of cells, an amount of energy, and a color (for drawing).
+    """ A plant that contains a genome of cells, an amount of energy, and a color (for drawing).
+
+    This class manages the state of the plant and how the plant grows.  The genome is shared with every other plant that
+    has the same one; the plant itself only keeps one CellState byte per genome entry plus a Cell for each living cell.
 
-    This class manages the state of the plant and how the plant grows.
+    Rather than scanning the whole genome every cycle, a plant keeps a heap of the indices of pending entries that may
+    be able to grow.  An entry is queued whenever it could have become growable: when a cell of this plant grows next
+    to its location, or when its location is freed while this plant is in the environment's growth frontier for it.
+    Entries that turn out not to be growable are dropped when they reach the top of the heap, so grow still picks the
+    first growable entry in genome order.
+
+    The energy, root_x, living_cell_count, creation_time, color, and whether the plant is alive are stored in the
+    PlantManager's registry under the plant's id, and are accessed through properties.
     """
 
-    def __init__(self, environment, root_x, root_y):
+    __slots__ = ("env", "id", "_registry", "root_y", "living_cells", "genome", "cell_states", "_growth_queue",
+                 "__weakref__")
+
+    def __init__(self, environment, root_x, root_y, plant_genome=genome.empty):
         self.env = environment
+        self._registry = environment.plant_manager.registry
+        self.id = self._registry.add(self)
         self.energy = environment.energy_in_new_plant
-        self._alive = False
         self.creation_time = environment.time
 
         self.root_x = root_x
         self.root_y = root_y
 
         index = id(self)
-        self.r = ((index * 5) % 7) * (255 // 6)
-        self.g = ((index * 5) % 11) * (255 // 10)
-        self.b = 255 - (self.r + self.g) // 2
-
-        self.living_cell_count = 0
-        self.cells = []
+        r = ((index * 5) % 7) * (255 // 6)
+        g = ((index * 5) % 11) * (255 // 10)
+        self._registry.color[self.id] = (r, g, 255 - (r + g) // 2)
+
+        self.living_cells = {}  # insertion-ordered set of living cells, including any no longer in the genome
+        self.genome = plant_genome
+        self.cell_states = bytearray(len(plant_genome))  # every entry starts as CellState.PENDING
+        self._growth_queue = []  # with no living cells, no entry can grow yet
         self.env.plant_manager.add_new_plant(self)
-        logging.debug("Created Plant id=%d  color=(%d, %d, %d)" % (id(self), self.r, self.g, self.b))
+
+    @property
+    def energy(self):
+        return self._registry.energy.item(self.id)
+
+    @energy.setter
+    def energy(self, energy):
+        self._registry.energy[self.id] = energy
+
+    @property
+    def root_x(self):
+        return self._registry.root_x.item(self.id)
+
+    @root_x.setter
+    def root_x(self, root_x):
+        self._registry.root_x[self.id] = root_x
+
+    @property
+    def living_cell_count(self):
+        return self._registry.living_cell_count.item(self.id)
+
+    @living_cell_count.setter
+    def living_cell_count(self, living_cell_count):
+        self._registry.living_cell_count[self.id] = living_cell_count
+
+    @property
+    def creation_time(self):
+        return self._registry.creation_time.item(self.id)
+
+    @creation_time.setter
+    def creation_time(self, creation_time):
+        self._registry.creation_time[self.id] = creation_time
+
+    @property
+    def r(self):
+        return self._registry.color.item(self.id, 0)
+
+    @property
+    def g(self):
+        return self._registry.color.item(self.id, 1)
+
+    @property
+    def b(self):
+        return self._registry.color.item(self.id, 2)
 
     def increment_energy(self, energy_delta):
-        self.energy += energy_delta
-        if self.energy < 0:
-            logging.debug("Killing whole plant due to low energy")
+        energy = self._registry.energy.item(self.id) + energy_delta
+        self._registry.energy[self.id] = energy
+        if energy < 0:
             self.set_living(False)
         return
 
     def is_alive(self):
         """ Returns boolean on whether the plant is currently alive. """
-        return self._alive
+        return self._registry.alive.item(self.id)
 
     def age(self):
         """ Returns integer of the current age of the plant. """
@@ -108,111 +239,246 @@ class Plant(object):
     def set_living(self, alive):
         """ Updates the state of the plant to the specified state. """
 
-        if self._alive == alive:
+        if self.is_alive() == alive:
             return
 
-        self._alive = alive
+        self._registry.alive[self.id] = alive
         if alive:
             # life of plant starts with one living cell
-            self.cells[0].set_living(True)
+            if self.env.tracer is not None:
+                self.env.tracer.record(self.env.time, tracing.PLANT_BORN, self.id, self.root_x, self.root_y,
+                                       value=len(self.genome))
+            c.Cell(self, 0).set_living(True)
             self.env.plant_manager.birth_count += 1
-            logging.debug("Plant is now alive")
+            if self.env.population is not None:
+                self.env.population.plant_born(self)
+            if self.env.state_hash is not None:
+                self.env.state_hash.plant_toggled(self, self.genome)
         else:
-            # death of plan kills all cells
-            for cell in self.cells:
-                logging.debug("Killing whole plant")
-                if cell.state() is c.CellState.ALIVE:
-                    cell.set_living(False)
+            if self.env.tracer is not None:
+                self.env.tracer.record(self.env.time, tracing.PLANT_DIED, self.id, self.root_x, self.root_y,
+                                       tracing.ENERGY if self.energy < 0 else tracing.NO_CELLS, self.age())
+            # death of plan kills all cells that are still part of its genome
+            killed_count = 0
+            for cell in list(self.living_cells):
+                if cell.index is not None:
+                    cell.set_living(False, tracing.PLANT_DEATH)
+                    killed_count += 1
+            if self.env.metrics is not None:
+                self.env.metrics.cells_killed_energy += killed_count
             self.env.plant_manager.death_count += 1
-            logging.debug("Plant is now dead")
+            if self.env.population is not None:
+                self.env.population.plant_died(self)
+            if self.env.state_hash is not None:
+                self.env.state_hash.plant_toggled(self, self.genome)
 
     def grow(self):
-        """ Grows any cells within the plant for which the plant has sufficient energy and whose locations are not
-        already occupied.
+        """ Grows the first cell in the genome for which the plant has sufficient energy and whose location is
+        unoccupied and connected to the plant.
         """
 
-        if self.energy < e.Environment.energy_per_cell:
-            return
-        for cell in self.cells:
-            if cell.state() is c.CellState.PENDING and cell.is_space_available() and \
-                    self.env.connected(self.root_x + cell.dx, self.root_y + cell.dy, self):
-                if cell.seed:
-                    if self.energy >= e.Environment.energy_per_seed:
-                        cell.set_living(True)
-                        self.energy -= e.Environment.energy_per_seed
-                        self._reproduce(cell.dx)
-                        break
-                else:
-                    if self.energy >= e.Environment.energy_per_cell:
-                        cell.set_living(True)
-                        self.energy -= e.Environment.energy_per_cell
-                        break
+        index = self.take_growth_candidate()
+        if index is not None:
+            self.grow_entry(index)
+
+    def take_growth_candidate(self):
+        """ Removes and returns the index of the entry that grow would grow now, or returns None if there is none.
+        Queued entries that can no longer grow are discarded along the way.
+        """
+
+        if self.energy < self.env.energy_per_cell:
+            return None
+        queue = self._growth_queue
+        unaffordable_seeds = []
+        candidate = None
+        while queue:
+            index = queue[0]
+            dx, dy, seed = self.genome.entries[index]
+            if self.cell_states[index] != c.CellState.PENDING or \
+                    not self.env.is_space_available(self.root_x + dx, self.root_y + dy) or \
+                    not self.env.connected(self.root_x + dx, self.root_y + dy, self):
+                heapq.heappop(queue)
+                continue
+            if seed and self.energy < self.env.energy_per_seed:
+                unaffordable_seeds.append(heapq.heappop(queue))
+                continue
+            candidate = heapq.heappop(queue)
+            break
+        for index in unaffordable_seeds:
+            heapq.heappush(queue, index)
+        return candidate
+
+    def return_growth_candidate(self, index):
+        """ Queues an entry taken by take_growth_candidate again, after it was not grown. """
+        heapq.heappush(self._growth_queue, index)
+
+    def grow_entry(self, index):
+        """ Grows the cell of the genome entry at index and pays for it.  A seed then reproduces. """
+
+        dx, dy, seed = self.genome.entries[index]
+        c.Cell(self, index).set_living(True)
+        if seed:
+            self.energy -= self.env.energy_per_seed
+            self._reproduce(dx)
+        else:
+            self.energy -= self.env.energy_per_cell
+
+    def growth_rank(self):
+        """ Returns the key by which plants that try to grow into the same location in a batched growth phase are
+        ranked.  The plant with the smallest key wins: the one with the most energy, then the oldest, then the one with
+        the lowest id.
+        """
+        return -self.energy, self.creation_time, self.id
+
+    def cell_placed(self, x, y):
+        """ Queues the pending entries next to a cell of this plant that has just come to life at (x, y). """
+
+        for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+            if self.env.valid_coords(x + dx, y + dy) and self.queue_pending_cells(x + dx, y + dy):
+                self.env.join_growth_frontier(x + dx, y + dy, self)
+
+    def queue_pending_cells(self, x, y):
+        """ Queues any pending entries of the genome at location (x, y) as candidates for growth.
+
+        :return: whether there were any pending entries at the location
+        """
+
+        indices = self.genome.locations.get((x - self.root_x, y - self.root_y))
+        if indices is None:
+            return False
+        queued = False
+        for index in indices:
+            if self.cell_states[index] == c.CellState.PENDING:
+                heapq.heappush(self._growth_queue, index)
+                queued = True
+        return queued
+
+    def rebuild_growth_queue(self):
+        """ Recomputes the queued entries and growth frontier from scratch after the genome has changed. """
+
+        self.leave_growth_frontier()
+        self.build_growth_queue()
+
+    def build_growth_queue(self):
+        """ Computes the queued entries and growth frontier of a plant that is not yet part of the frontier. """
+
+        env = self.env
+        root_x = self.root_x
+        root_y = self.root_y
+        entries = self.genome.entries
+        # A pending entry is queued if its location is next to one of the plant's living cells
+        cell_locations = set([(cell.dx, cell.dy) for cell in self.living_cells])
+        queue = []
+        joined = set()
+        index = self.cell_states.find(c.CellState.PENDING)
+        while index >= 0:
+            dx, dy, _ = entries[index]
+            if ((dx - 1, dy) in cell_locations or (dx + 1, dy) in cell_locations or (dx, dy - 1) in cell_locations or
+                    (dx, dy + 1) in cell_locations) and env.valid_coords(root_x + dx, root_y + dy):
+                queue.append(index)
+                if (dx, dy) not in joined:
+                    joined.add((dx, dy))
+                    env.join_growth_frontier(root_x + dx, root_y + dy, self)
+            index = self.cell_states.find(c.CellState.PENDING, index + 1)
+        self._growth_queue = queue  # already a heap, being in increasing order
+
+    def leave_growth_frontier(self):
+        """ Removes this plant from the environment's growth frontier at every location in its genome. """
+
+        for dx, dy in self.genome.locations:
+            self.env.leave_growth_frontier(self.root_x + dx, self.root_y + dy, self)
 
     def _reproduce(self, dx):
         """ Creates a copy of this plant with possible mutations.
 
+        The baby shares this plant's genome.  Any mutation then gives this plant a new genome.
+
         dx: the location where the copy of the plant will attempt to start growing.
         """
 
-        # TODO: Move constants to a general area for configuration parameters
-        mutation_probability = .1
-        mutation_addition_probability = .5
-        mutation_max_cell_additions = 5
-        mutation_max_cell_removals = 5
-
-        x = self.root_x + dx + random.randint(-e.Environment.seed_spread, e.Environment.seed_spread)
+        x = self.root_x + dx + self.env.rng.randint(-self.env.seed_spread, self.env.seed_spread)
         y = self.root_y
+        if self.env.metrics is not None:
+            self.env.metrics.seeds_attempted += 1
         if not self.env.is_space_available(x, y):
+            if self.env.tracer is not None:
+                self.env.tracer.record(self.env.time, tracing.SEED_BLOCKED, self.id, x, y)
             return
-        baby = Plant(self.env, x, y)
-        for cell in self.cells:
-            baby.append_cell(cell.dx, cell.dy, cell.seed)
-        baby.set_living(True)
-
-        mutate = random.random() < mutation_probability
+        if self.env.metrics is not None:
+            self.env.metrics.seeds_landed += 1
+        if self.env.tracer is not None:
+            self.env.tracer.record(self.env.time, tracing.SEED_LANDED, self.id, x, y)
+        seedling = self.env.add_seedling(x, y, self.genome)
+        if self.env.population is not None:
+            self.env.population.seed_landed(self.env.time, self, seedling)
+
+        mutate = self.env.rng.random() < self.env.mutation_probability
         if mutate:
-            do_addition = random.random() < mutation_addition_probability
+            old_genome = self.genome
+            do_addition = self.env.rng.random() < self.env.mutation_addition_probability
             if do_addition:
-                add_count = random.randint(1, mutation_max_cell_additions)
+                add_count = self.env.rng.randint(1, self.env.mutation_max_cell_additions)
                 for _ in range(add_count):
                     self._mutate_add()
+                if self.env.tracer is not None:
+                    self.env.tracer.record(self.env.time, tracing.MUTATION, self.id, self.root_x, self.root_y,
+                                           tracing.ADDITION, add_count)
             else:
-                remove_count = random.randint(1, mutation_max_cell_removals)
+                remove_count = self.env.rng.randint(1, self.env.mutation_max_cell_removals)
                 for _ in range(remove_count):
                     self._mutate_remove()
-        logging.debug("Created baby Plant")
+                if self.env.tracer is not None:
+                    self.env.tracer.record(self.env.time, tracing.MUTATION, self.id, self.root_x, self.root_y,
+                                           tracing.REMOVAL, remove_count)
+            if self.env.population is not None:
+                self.env.population.genome_changed(self, old_genome)
+            if self.env.state_hash is not None and self.is_alive():
+                self.env.state_hash.plant_toggled(self, old_genome)
+                self.env.state_hash.plant_toggled(self, self.genome)
 
     def _mutate_remove(self):
-        """ Mutates the current list of cells by removing a random subset of the cells. """
+        """ Mutates the current genome by removing a random cell.
+
+        A living cell that is removed stays alive, but is no longer part of the genome.
+        """
 
         # if there is only one cell left, we can't remove any more
-        if len(self.cells) <= 1:
+        if len(self.genome) <= 1:
             return
         # removes a random cell other than the root cell
-        removal_index = random.randint(1, len(self.cells) - 1)
-        del self.cells[removal_index]
+        removal_index = self.env.rng.randint(1, len(self.genome) - 1)
+        self.leave_growth_frontier()
+        self.genome = self.genome.removed(removal_index)
+        del self.cell_states[removal_index]
+        for cell in self.living_cells:
+            if cell.index is None or cell.index < removal_index:
+                continue
+            cell.index = None if cell.index == removal_index else cell.index - 1
+        self.rebuild_growth_queue()
 
     def _mutate_add(self):
-        """ Mutates the current list of cells by adding a random number of cells. """
+        """ Mutates the current genome by adding a cell next to a random existing cell. """
 
-        # TODO: Move constants to a general area for configuration parameters
-        mutation_seed_probability = .1
-
-        parent_index = random.randint(0, len(self.cells) - 1)
-        dx = self.cells[parent_index].dx
-        dy = self.cells[parent_index].dy
-        delta = random.randint(0, 1) * 2 - 1  # Randomly selects direction of new cell to be +1 or -1
-        if random.randint(0, 1) == 0:  # randomly selects direction of shift to be horizontal or vertical
+        parent_index = self.env.rng.randint(0, len(self.genome) - 1)
+        dx, dy, _ = self.genome[parent_index]
+        delta = self.env.rng.randint(0, 1) * 2 - 1  # Randomly selects direction of new cell to be +1 or -1
+        if self.env.rng.randint(0, 1) == 0:  # randomly selects direction of shift to be horizontal or vertical
             dx += delta
         else:
             dy += delta
-        seed = random.random() < mutation_seed_probability
-        self.cells.insert(parent_index + 1, c.Cell(self, dx, dy, seed))
+        seed = self.env.rng.random() < self.env.mutation_seed_probability
+        self.leave_growth_frontier()
+        self.genome = self.genome.inserted(parent_index + 1, (dx, dy, seed))
+        self.cell_states.insert(parent_index + 1, c.CellState.PENDING)
+        for cell in self.living_cells:
+            if cell.index is not None and cell.index > parent_index:
+                cell.index += 1
+        self.rebuild_growth_queue()
 
     def append_cell(self, dx, dy, seed=False):
         """ Adds on another cell that is in a state of PENDING at the specified location. """
 
-        self.cells.append(c.Cell(self, dx, dy, seed))
+        self._append_cells([(dx, dy, seed)])
 
     def append_cells_up(self, dx, dy, count, seed=False):
         """ Adds multiple cells above the specified location.
@@ -223,8 +489,7 @@ class Plant(object):
         seed: type of cell to add (normal or seed)
         """
 
-        for i in range(count):
-            self.cells.append(c.Cell(self, dx, dy + i, seed))
+        self._append_cells([(dx, dy + i, seed) for i in range(count)])
 
     def append_cells_wide(self, dx, dy, count, seed=False):
         """ Adds multiple cells to either side of the specified location.
@@ -235,6 +500,16 @@ class Plant(object):
         seed: type of cell to add (normal or seed)
         """
 
+        entries = []
         for i in range(1, count + 1):
-            self.cells.append(c.Cell(self, dx + i, dy, seed))
-            self.cells.append(c.Cell(self, dx - i, dy, seed))
+            entries.append((dx + i, dy, seed))
+            entries.append((dx - i, dy, seed))
+        self._append_cells(entries)
+
+    def _append_cells(self, entries):
+        """ Adds PENDING cells with the specified (dx, dy, seed) entries to the end of the genome. """
+
+        self.leave_growth_frontier()
+        self.genome = self.genome.appended(entries)
+        self.cell_states.extend(bytearray(len(entries)))
+        self.rebuild_growth_queue()
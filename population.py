@@ -0,0 +1,243 @@
+import struct
+import numpy as np
+
+# Columns of the table with one row per cycle, and of the table with one row per seedling
+cycle_dtype = np.dtype([("time", "<i4"), ("births", "<i4"), ("deaths", "<i4"), ("living", "<i4"),
+                        ("genome_entries", "<i8"), ("seed_entries", "<i8"), ("lineage_depth_sum", "<i8"),
+                        ("max_lineage_depth", "<i4"), ("covered_columns", "<i4")])
+lineage_dtype = np.dtype([("time", "<i4"), ("parent", "<i4"), ("child", "<i4"), ("depth", "<i4"),
+                          ("genome_length", "<i4")])
+_file_magic = b"DARWINPOP1\n"
+_cycle_block = b"C"
+_lineage_block = b"L"
+
+
+class PopulationRecorder(object):
+    """ Keeps a time series of the living population and a table of which plant each seedling came from.
+
+    The PlantManager and plants report each birth, death, mutation, landed seed and pruned plant as it happens, and the
+    recorder keeps running totals over the living plants: their number, the distribution of their genome sizes, how
+    many of their genome entries are seeds (so seed_entries / genome_entries is the seed fraction), and the sum and
+    maximum of their lineage depths (the number of generations back to a plant with no recorded parent).  At the end of
+    each cycle the totals, the births and deaths during the cycle and the number of columns with a living cell are
+    copied into one row of preallocated columns, so the cost of a cycle does not depend on the size of the population.
+
+    Plants are numbered in the order in which the recorder first saw them.  The plants that were alive when recording
+    started, and plants that do not grow from a seed, have a lineage depth of zero and no row in the lineage table.
+
+    With a path, each table is written to the file as a columnar block whenever its block_size rows are full.  Without
+    one, full blocks are kept in memory.
+    """
+
+    def __init__(self, env, path=None, block_size=4096, max_genome_size=64):
+        """
+        env: the environment whose population is recorded, whose living plants are counted immediately
+        max_genome_size: number of genome size bins; larger genomes are counted in the last bin
+        """
+
+        self.block_size = block_size
+        self.max_genome_size = max_genome_size
+        self._cycles = np.zeros(block_size, dtype=cycle_dtype)
+        self._genome_sizes = np.zeros((block_size, max_genome_size), dtype=np.int32)
+        self._cycle_count = 0
+        self._lineage = np.zeros(block_size, dtype=lineage_dtype)
+        self._lineage_count = 0
+        self._cycle_blocks = []  # (cycles, genome_sizes) of each full block, when there is no path
+        self._lineage_blocks = []
+        self._sink = None
+        if path:
+            self._sink = open(path, "wb")
+            self._sink.write(_file_magic + struct.pack("<I", max_genome_size))
+
+        self._plants = {}  # plant -> [number, lineage depth] until it is pruned
+        self._next_number = 0
+        self.births = 0
+        self.deaths = 0
+        self.living = 0
+        self.genome_size_counts = [0] * max_genome_size
+        self.genome_entries = 0
+        self.seed_entries = 0
+        self.lineage_depth_sum = 0
+        self.max_lineage_depth = 0
+        self._depth_counts = [0]  # number of living plants at each lineage depth
+        for plant in env.plant_manager.plants + env.plant_manager._new_plants:
+            self._number(plant)
+            if plant.is_alive():
+                self._count_living(plant, plant.genome, 1)
+
+    def _number(self, plant):
+        """ Returns the record of [number, lineage depth] of the plant, numbering it if it is new. """
+
+        record = self._plants.get(plant)
+        if record is None:
+            record = self._plants[plant] = [self._next_number, 0]
+            self._next_number += 1
+        return record
+
+    def _count_living(self, plant, plant_genome, sign):
+        """ Adds (sign 1) or removes (sign -1) a living plant with the specified genome from the running totals. """
+
+        self.living += sign
+        self.genome_size_counts[min(len(plant_genome), self.max_genome_size - 1)] += sign
+        self.genome_entries += sign * len(plant_genome)
+        self.seed_entries += sign * plant_genome.seed_count
+        self._count_depth(self._plants[plant][1], sign)
+
+    def _count_depth(self, depth, sign):
+        """ Adds (sign 1) or removes (sign -1) a living plant at the given lineage depth from the running totals. """
+
+        self.lineage_depth_sum += sign * depth
+        if depth == len(self._depth_counts):
+            self._depth_counts.append(0)
+        self._depth_counts[depth] += sign
+        if sign > 0:
+            if depth > self.max_lineage_depth:
+                self.max_lineage_depth = depth
+        else:
+            while self.max_lineage_depth and not self._depth_counts[self.max_lineage_depth]:
+                self.max_lineage_depth -= 1
+
+    def plant_born(self, plant):
+        """ Counts a plant that has just come to life. """
+
+        self._number(plant)
+        self.births += 1
+        self._count_living(plant, plant.genome, 1)
+
+    def plant_died(self, plant):
+        """ Counts a plant that has just died. """
+
+        self.deaths += 1
+        self._count_living(plant, plant.genome, -1)
+
+    def seed_landed(self, time, parent, seedling):
+        """ Records that seedling, which has just come to life, grew from a seed of parent. """
+
+        record = self._plants[seedling]
+        depth = self._number(parent)[1] + 1
+        self._count_depth(record[1], -1)
+        self._count_depth(depth, 1)
+        record[1] = depth
+        if self._lineage_count == self.block_size:
+            self._flush_lineage()
+        self._lineage[self._lineage_count] = (time, self._plants[parent][0], record[0], depth, len(seedling.genome))
+        self._lineage_count += 1
+
+    def genome_changed(self, plant, old_genome):
+        """ Moves a plant whose genome has just mutated from old_genome to its new genome in the running totals. """
+
+        if plant.is_alive():
+            self._count_living(plant, old_genome, -1)
+            self._count_living(plant, plant.genome, 1)
+
+    def plant_pruned(self, plant):
+        """ Forgets a plant that is no longer tracked. """
+        self._plants.pop(plant, None)
+
+    def end_step(self, env):
+        """ Writes the row of the cycle that has just ended and starts counting the births and deaths of the next. """
+
+        if self._cycle_count == self.block_size:
+            self._flush_cycles()
+        row = self._cycle_count
+        self._cycles[row] = (env.time, self.births, self.deaths, self.living, self.genome_entries, self.seed_entries,
+                             self.lineage_depth_sum, self.max_lineage_depth,
+                             np.count_nonzero(env.column_tops >= 0))
+        self._genome_sizes[row] = self.genome_size_counts
+        self._cycle_count += 1
+        self.births = 0
+        self.deaths = 0
+
+    def _flush_cycles(self):
+        if self._sink is not None:
+            _write_block(self._sink, _cycle_block, self._cycles[:self._cycle_count],
+                         self._genome_sizes[:self._cycle_count])
+        else:
+            self._cycle_blocks.append((self._cycles[:self._cycle_count].copy(),
+                                       self._genome_sizes[:self._cycle_count].copy()))
+        self._cycle_count = 0
+
+    def _flush_lineage(self):
+        if self._sink is not None:
+            _write_block(self._sink, _lineage_block, self._lineage[:self._lineage_count])
+        else:
+            self._lineage_blocks.append((self._lineage[:self._lineage_count].copy(),))
+        self._lineage_count = 0
+
+    def cycles(self):
+        """ Returns the rows recorded so far as a dictionary of column name to array, plus genome_sizes, a
+        (cycles, max_genome_size) array of the number of living plants with each genome size.  Without a path only.
+        """
+
+        blocks = self._cycle_blocks + [(self._cycles[:self._cycle_count], self._genome_sizes[:self._cycle_count])]
+        return _columns(cycle_dtype, blocks, self.max_genome_size)
+
+    def lineage(self):
+        """ Returns the lineage rows recorded so far as a dictionary of column name to array.  Without a path only. """
+
+        return _columns(lineage_dtype, self._lineage_blocks + [(self._lineage[:self._lineage_count],)])
+
+    def close(self):
+        """ Writes any partial blocks and closes the file. """
+
+        if self._sink is not None:
+            self._flush_cycles()
+            self._flush_lineage()
+            self._sink.close()
+            self._sink = None
+
+
+def _write_block(sink, kind, rows, genome_sizes=None):
+    """ Writes a block of rows as a kind byte and a row count followed by each column in turn. """
+
+    if not len(rows):
+        return
+    sink.write(kind + struct.pack("<I", len(rows)))
+    for name in rows.dtype.names:
+        sink.write(np.ascontiguousarray(rows[name]).tobytes())
+    if genome_sizes is not None:
+        sink.write(np.ascontiguousarray(genome_sizes).tobytes())
+
+
+def _columns(dtype, blocks, max_genome_size=None):
+    """ Returns the concatenated columns of blocks of rows (each followed by any genome size counts). """
+
+    if not blocks:
+        blocks = [(np.zeros(0, dtype=dtype), np.zeros((0, max_genome_size or 0), dtype=np.int32))]
+    columns = dict((name, np.concatenate([block[0][name] for block in blocks])) for name in dtype.names)
+    if max_genome_size is not None:
+        columns["genome_sizes"] = np.concatenate([block[1] for block in blocks]).reshape(-1, max_genome_size)
+    return columns
+
+
+def read(path):
+    """ Reads a file written by a PopulationRecorder and returns (cycles, lineage): a dictionary of column name to array
+    for each table, as returned by PopulationRecorder.cycles and PopulationRecorder.lineage.
+    """
+
+    with open(path, "rb") as population_file:
+        data = population_file.read()
+    if not data.startswith(_file_magic):
+        raise ValueError("%s is not a population file" % path)
+    offset = len(_file_magic)
+    max_genome_size, = struct.unpack_from("<I", data, offset)
+    offset += 4
+    cycle_blocks = []
+    lineage_blocks = []
+    while offset < len(data):
+        kind = data[offset:offset + 1]
+        count, = struct.unpack_from("<I", data, offset + 1)
+        offset += 5
+        dtype = cycle_dtype if kind == _cycle_block else lineage_dtype
+        rows = np.zeros(count, dtype=dtype)
+        for name in dtype.names:
+            field_dtype = dtype.fields[name][0]
+            rows[name] = np.frombuffer(data, dtype=field_dtype, count=count, offset=offset)
+            offset += count * field_dtype.itemsize
+        if kind == _cycle_block:
+            genome_sizes = np.frombuffer(data, dtype=np.int32, count=count * max_genome_size, offset=offset)
+            offset += genome_sizes.nbytes
+            cycle_blocks.append((rows, genome_sizes))
+        else:
+            lineage_blocks.append((rows,))
+    return _columns(cycle_dtype, cycle_blocks, max_genome_size), _columns(lineage_dtype, lineage_blocks)
@@ -0,0 +1,66 @@
+import numpy as np
+
+
+def run_seeds(base_seed, run_count):
+    """ Returns run_count independent seeds derived from base_seed, such as one for each run of a sweep or each strip
+    of a parallel run.
+    """
+
+    return [int(sequence.generate_state(1)[0]) for sequence in np.random.SeedSequence(base_seed).spawn(run_count)]
+
+
+class RandomStream(object):
+    """ An environment's own stream of random numbers, drawn from a seeded NumPy PCG64 generator.
+
+    Uniform draws are generated in blocks of block_size and handed out one at a time, so each draw is a list lookup
+    rather than a call into the generator.  Two streams with the same seed produce the same draws, regardless of what
+    any other stream in the process does.
+    """
+
+    def __init__(self, seed=None, block_size=1024):
+        """
+        seed: integer seed, or None to seed from fresh operating system entropy
+        """
+
+        self.block_size = block_size
+        self._generator = np.random.Generator(np.random.PCG64(seed))
+        self._refill()
+
+    def _refill(self):
+        """ Replaces the block of draws with the next block_size draws of the generator. """
+
+        self._block_state = self._generator.bit_generator.state  # lets getstate describe the current block
+        self._block = self._generator.random(self.block_size).tolist()
+        self._position = 0
+
+    def random(self):
+        """ Returns the next random float in the range [0.0, 1.0). """
+
+        if self._position == self.block_size:
+            self._refill()
+        value = self._block[self._position]
+        self._position += 1
+        return value
+
+    def randint(self, low, high):
+        """ Returns a random integer N such that low <= N <= high. """
+
+        # Same as random(), written out because this is called for every seed and mutation
+        if self._position == self.block_size:
+            self._refill()
+        value = self._block[self._position]
+        self._position += 1
+        return low + int(value * (high - low + 1))
+
+    def getstate(self):
+        """ Returns a JSON serializable object capturing the current state of the stream, for setstate. """
+
+        return {"block_state": self._block_state, "block_size": self.block_size, "position": self._position}
+
+    def setstate(self, state):
+        """ Restores the stream to a state returned by getstate. """
+
+        self.block_size = state["block_size"]
+        self._generator.bit_generator.state = state["block_state"]
+        self._refill()
+        self._position = state["position"]
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+class PlantRegistry(object):
+    """ Struct-of-arrays store of the state of every tracked plant, indexed by a stable integer plant id.
+
+    A plant keeps its id from the time it is created until it is removed, after which the id goes on a free list and is
+    reused by a later plant.  Per-plant fields are kept in parallel NumPy arrays so that whole-population updates, such
+    as the energy given and taken each cycle, can be applied as a single scatter-add.  in_use marks the ids of plants
+    that are currently tracked.
+    """
+
+    def __init__(self, capacity=64):
+        self.plants = [None] * capacity
+        self.in_use = np.zeros(capacity, dtype=bool)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.energy = np.zeros(capacity, dtype=np.int64)
+        self.root_x = np.zeros(capacity, dtype=np.int64)
+        self.living_cell_count = np.zeros(capacity, dtype=np.int64)
+        self.creation_time = np.zeros(capacity, dtype=np.int64)
+        self.color = np.zeros((capacity, 3), dtype=np.uint8)
+        self._free_ids = list(reversed(range(capacity)))
+
+    def capacity(self):
+        """ Returns the number of ids for which storage is allocated.  Every id in use is less than this. """
+        return len(self.plants)
+
+    def add(self, plant, plant_id=None):
+        """ Assigns an id to the plant, doubling the storage if every id is in use, and returns the id.
+
+        plant_id: id to give the plant instead of the next free one, when restoring ids with restore_free_ids
+        """
+
+        if plant_id is None:
+            if not self._free_ids:
+                self._grow()
+            plant_id = self._free_ids.pop()
+        self.plants[plant_id] = plant
+        self.in_use[plant_id] = True
+        return plant_id
+
+    def remove(self, plant_id):
+        """ Stops tracking the plant with the specified id, and frees the id in O(1). """
+
+        self.plants[plant_id] = None
+        self.in_use[plant_id] = False
+        self.alive[plant_id] = False
+        self.energy[plant_id] = 0
+        self.living_cell_count[plant_id] = 0
+        self._free_ids.append(plant_id)
+
+    def restore_free_ids(self, capacity, free_ids):
+        """ Grows the storage to capacity and replaces the free list, so that plants added with their saved ids, and
+        any added after them, get the same ids as in the run that was saved.
+        """
+
+        while len(self.plants) < capacity:
+            self._grow()
+        self._free_ids = list(free_ids)
+
+    def live_ids(self):
+        """ Returns an array of the ids that are in use, in increasing order. """
+        return np.flatnonzero(self.in_use)
+
+    def _grow(self):
+        """ Doubles the storage, adding the new ids to the free list. """
+
+        capacity = len(self.plants)
+        self.plants.extend([None] * capacity)
+        for name in ("in_use", "alive", "energy", "root_x", "living_cell_count", "creation_time", "color"):
+            old = getattr(self, name)
+            new = np.zeros((2 * capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:capacity] = old
+            setattr(self, name, new)
+        self._free_ids.extend(reversed(range(capacity, 2 * capacity)))
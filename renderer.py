@@ -0,0 +1,129 @@
+import os
+import queue
+import struct
+import subprocess
+import threading
+import zlib
+import numpy as np
+
+
+def frame(env):
+    """ Returns an RGB image of the environment as a (height, width, 3) uint8 array with the top of the world in row 0.
+
+    Each location is coloured by looking up its plant id in the registry's colour table; empty locations are black.
+    """
+
+    # Appending black to the palette makes the empty id of -1 select it
+    palette = np.concatenate((env.plant_manager.registry.color, np.zeros((1, 3), dtype=np.uint8)))
+    return palette[env.plant_id_grid()[:, ::-1].T]
+
+
+def png_bytes(image):
+    """ Encodes a (height, width, 3) uint8 image as a PNG file. """
+
+    height, width, _ = image.shape
+    rows = np.zeros((height, 1 + 3 * width), dtype=np.uint8)  # each row starts with filter type 0
+    rows[:, 1:] = image.reshape(height, 3 * width)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    return (b"\x89PNG\r\n\x1a\n" +
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) +
+            chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)) +
+            chunk(b"IEND", b""))
+
+
+class RawRGBSink(object):
+    """ Appends each frame to a single file as raw rgb24 bytes (readable with ffmpeg -f rawvideo -pix_fmt rgb24). """
+
+    def __init__(self, path):
+        self._file = open(path, "wb")
+
+    def write(self, time, image):
+        self._file.write(image.tobytes())
+
+    def close(self):
+        self._file.close()
+
+
+class PNGSequenceSink(object):
+    """ Writes each frame to its own PNG file in a directory, named by the cycle at which it was taken. """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def write(self, time, image):
+        with open(os.path.join(self.directory, "frame_%08d.png" % time), "wb") as png_file:
+            png_file.write(png_bytes(image))
+
+    def close(self):
+        pass
+
+
+class FFmpegSink(object):
+    """ Pipes each frame as raw rgb24 to an ffmpeg process, which encodes them into a video file. """
+
+    def __init__(self, path, width, height, frame_rate=30, ffmpeg="ffmpeg"):
+        self._process = subprocess.Popen([ffmpeg, "-loglevel", "error", "-y", "-f", "rawvideo", "-pix_fmt", "rgb24",
+                                          "-s", "%dx%d" % (width, height), "-r", str(frame_rate), "-i", "-",
+                                          "-pix_fmt", "yuv420p", path], stdin=subprocess.PIPE)
+
+    def write(self, time, image):
+        self._process.stdin.write(image.tobytes())
+
+    def close(self):
+        self._process.stdin.close()
+        self._process.wait()
+
+
+class FrameRecorder(object):
+    """ Takes a frame of an environment every few cycles and writes it to a sink on a background thread.
+
+    The simulation only pays for the vectorized colour lookup.  Encoding and writing happen on the writer thread, and
+    the simulation only waits when more than max_pending frames are queued, which keeps memory use bounded.
+    """
+
+    def __init__(self, sink, every=1, max_pending=16):
+        self.sink = sink
+        self.every = every
+        self._frames = queue.Queue(max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._write_frames)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def end_step(self, env):
+        """ Queues a frame of the environment if this is one of the cycles to record. """
+
+        if env.time % self.every == 0:
+            self.record(env)
+
+    def record(self, env):
+        """ Queues a frame of the current state of the environment. """
+
+        if self._error is not None:
+            raise self._error
+        self._frames.put((env.time, env.frame()))
+
+    def close(self):
+        """ Waits for the queued frames to be written and closes the sink. """
+
+        self._frames.put(None)
+        self._thread.join()
+        self.sink.close()
+        if self._error is not None:
+            raise self._error
+
+    def _write_frames(self):
+        while True:
+            item = self._frames.get()
+            if item is None:
+                return
+            if self._error is None:
+                try:
+                    self.sink.write(*item)
+                except Exception as error:
+                    self._error = error
@@ -0,0 +1,109 @@
+import argparse
+import bisect
+import json
+import os
+import array_environment
+import environment
+import renderer
+import sparse_environment
+
+environment_classes = dict((environment_class.__name__, environment_class) for environment_class in
+                           (environment.Environment, array_environment.ArrayEnvironment,
+                            sparse_environment.SparseEnvironment))
+
+
+class ReplayRecorder(object):
+    """ Records a run compactly enough that the world at any cycle can be reconstructed afterwards.
+
+    Because a run is determined by its starting state and the state of its random number stream, only a compressed
+    checkpoint (a keyframe) of the starting state and of every keyframe_every-th cycle is kept, plus an index of them in
+    replay.json.  replay restores the latest keyframe at or before the requested cycle and simulates forward from there,
+    so seeking never simulates more than keyframe_every cycles.
+    """
+
+    def __init__(self, directory, env, keyframe_every=1000):
+        """
+        directory: directory in which the index and keyframes are written
+        env: the environment being recorded, which is keyframed immediately
+        """
+
+        if type(env).__name__ not in environment_classes:
+            raise ValueError("Cannot record a replay of %s" % type(env).__name__)
+        self.directory = directory
+        self.keyframe_every = keyframe_every
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._index = {"environment_class": type(env).__name__, "width": env.width, "height": env.height,
+                       "keyframe_every": keyframe_every, "keyframes": [], "last_cycle": None}
+        self.record_keyframe(env)
+
+    def end_step(self, env):
+        """ Records a keyframe if this is one of the cycles to keyframe. """
+
+        if env.time % self.keyframe_every == 0:
+            self.record_keyframe(env)
+
+    def record_keyframe(self, env):
+        """ Writes a keyframe of the current state of the environment and adds it to the index. """
+
+        env.save(os.path.join(self.directory, _keyframe_name(env.time)), compressed=True)
+        if not self._index["keyframes"] or self._index["keyframes"][-1] < env.time:
+            self._index["keyframes"].append(env.time)
+        self._write_index()
+
+    def close(self, env):
+        """ Records the last cycle of the run, beyond which replay will not simulate. """
+
+        self._index["last_cycle"] = env.time
+        self._write_index()
+
+    def _write_index(self):
+        with open(os.path.join(self.directory, "replay.json"), "w") as index_file:
+            json.dump(self._index, index_file)
+
+
+def _keyframe_name(time):
+    return "keyframe_%08d.npz" % time
+
+
+def replay(directory, to_cycle):
+    """ Returns an environment in the state that the recorded run was in after to_cycle cycles. """
+
+    with open(os.path.join(directory, "replay.json")) as index_file:
+        index = json.load(index_file)
+    keyframes = index["keyframes"]
+    if to_cycle < keyframes[0] or (index["last_cycle"] is not None and to_cycle > index["last_cycle"]):
+        raise ValueError("Cycle %d is outside of the recorded run" % to_cycle)
+    keyframe = keyframes[bisect.bisect_right(keyframes, to_cycle) - 1]
+    env = environment_classes[index["environment_class"]].load(os.path.join(directory, _keyframe_name(keyframe)))
+    while env.time < to_cycle:
+        env.step_time()
+    return env
+
+
+def main():
+    """
+    Reconstructs the world of a recorded run at a chosen cycle, and displays it or writes it to a PNG file.
+
+    :return: None
+    """
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("directory", help="Directory of a replay recorded with controller.py --replay-log")
+    parser.add_argument("-c", "--cycle", dest="cycle", type=int, required=True, help="Cycle to reconstruct")
+    parser.add_argument("-o", "--output", dest="output", default=None,
+                        help="PNG file to which the world is written instead of being displayed")
+
+    args = parser.parse_args()
+
+    env = replay(args.directory, args.cycle)
+    print("Environment at cycle_time: %d with %d plants" % (env.time, env.plant_manager.living_count()))
+    if args.output:
+        with open(args.output, "wb") as png_file:
+            png_file.write(renderer.png_bytes(env.frame()))
+    else:
+        env.draw_pyplot()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import numpy as np
+import environment
+
+
+class ChunkedColumns(dict):
+    """ The columns of a grid by x, holding a list only for the columns of allocated chunks.
+
+    Reading any other column returns a shared empty column, so cells[x][y] is None for every empty location, just as in
+    a dense grid.  Only the environment writes to the grid, after allocating the chunk.
+    """
+
+    def __init__(self, height):
+        super(ChunkedColumns, self).__init__()
+        self.empty_column = (None,) * height
+
+    def __missing__(self, x):
+        return self.empty_column
+
+
+class SparseEnvironment(environment.Environment):
+    """
+    Environment whose grid is divided into chunks of chunk_width columns that are only allocated while they hold a cell.
+
+    Each allocated chunk counts its cells, and is freed when the count drops to zero.  The phases and queries that visit
+    every location (taking energy, the full connectivity search and plant_id_grid) only visit the columns of allocated
+    chunks, so very wide worlds whose plants live in a few patches cost memory and time in proportion to the patches
+    rather than the width.
+
+    For the same random seed, the results match Environment step for step.
+    """
+
+    chunk_width = 64
+
+    def __init__(self, width, height, seed=None):
+        self.chunk_counts = {}  # chunk number -> number of living cells in the chunk, for each allocated chunk
+        super(SparseEnvironment, self).__init__(width, height, seed)
+
+    def _new_grid(self):
+        """ Returns an empty grid with no chunks allocated. """
+        return ChunkedColumns(self.height)
+
+    def _occupied_columns(self):
+        """ Returns the x of every column in an allocated chunk, in increasing order. """
+
+        columns = []
+        for chunk in sorted(self.chunk_counts):
+            columns.extend(range(chunk * self.chunk_width, min(self.width, (chunk + 1) * self.chunk_width)))
+        return columns
+
+    def place_cell(self, x, y, cell):
+        """ Records that the specified living cell now occupies location (x, y), allocating its chunk if needed. """
+
+        self._count_chunk_cells(x // self.chunk_width, 1)
+        super(SparseEnvironment, self).place_cell(x, y, cell)
+
+    def restore_cells(self, cells, xs, ys, plant_ids, creation_times):
+        """ Records that the specified living cells of a checkpoint occupy their locations, allocating their chunks, as
+        described in Environment.restore_cells.
+        """
+
+        chunks, counts = np.unique(xs // self.chunk_width, return_counts=True)
+        for chunk, count in zip(chunks.tolist(), counts.tolist()):
+            self._count_chunk_cells(chunk, count)
+        super(SparseEnvironment, self).restore_cells(cells, xs, ys, plant_ids, creation_times)
+
+    def _count_chunk_cells(self, chunk, count):
+        """ Adds count new cells to a chunk, allocating it if needed. """
+
+        old_count = self.chunk_counts.get(chunk)
+        if old_count is None:
+            for column_x in range(chunk * self.chunk_width, min(self.width, (chunk + 1) * self.chunk_width)):
+                self.cells[column_x] = [None] * self.height
+            old_count = 0
+        self.chunk_counts[chunk] = old_count + count
+
+    def remove_cell(self, x, y, cell):
+        """ Records that the specified cell died and no longer occupies location (x, y), freeing its chunk if it is now
+        empty.
+        """
+
+        super(SparseEnvironment, self).remove_cell(x, y, cell)
+        chunk = x // self.chunk_width
+        count = self.chunk_counts[chunk] - 1
+        if count:
+            self.chunk_counts[chunk] = count
+        else:
+            del self.chunk_counts[chunk]
+            for column_x in range(chunk * self.chunk_width, min(self.width, (chunk + 1) * self.chunk_width)):
+                del self.cells[column_x]
@@ -0,0 +1,122 @@
+import collections
+import numpy as np
+
+_mask = (1 << 64) - 1
+
+
+def _split_mix(value):
+    """ Returns a well mixed 64 bit key for an integer, by the finalizer of the SplitMix64 generator. """
+
+    value = (value + 0x9E3779B97F4A7C15) & _mask
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _mask
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _mask
+    return value ^ (value >> 31)
+
+
+class StateHash(object):
+    """ A Zobrist hash of the configuration of an environment, updated as cells and plants come and go.
+
+    Every location and every root column has random 64 bit keys, which are derived when needed by mixing the index of
+    the location or column with a seeded offset, so they take no memory however large the world is.  Each living cell
+    contributes the key of its location mixed with the key of its plant's root column, and each living plant contributes
+    the key of its root column mixed with a hash of its genome.  The contributions are combined with exclusive or, so a
+    cell or plant is added or removed in O(1) by the same operation, and two identical configurations have the same
+    value whatever order they were reached in.  Cell ages, energies and the random number stream are not part of the
+    configuration.
+    """
+
+    def __init__(self, env, seed=0):
+        """
+        env: the environment to hash, whose current cells and plants are hashed immediately
+        seed: seed of the random keys
+        """
+
+        generator = np.random.Generator(np.random.PCG64(seed))
+        self._cell_offset, self._root_offset, self._plant_offset = generator.integers(0, 1 << 63, size=3).tolist()
+        self._height = env.height
+        self.value = 0
+        for plant in env.plant_manager.plants + env.plant_manager._new_plants:
+            if plant.is_alive():
+                self.plant_toggled(plant, plant.genome)
+            for cell in plant.living_cells:
+                self.cell_toggled(plant.root_x + cell.dx, plant.root_y + cell.dy, plant)
+
+    def cell_toggled(self, x, y, plant):
+        """ Adds or removes a living cell of plant at location (x, y). """
+        # Odd multipliers are invertible modulo 2 ** 64, so mixing never loses a key
+        root_key = _split_mix(self._root_offset + plant.root_x) | 1
+        self.value ^= (_split_mix(self._cell_offset + x * self._height + y) * root_key) & _mask
+
+    def plant_toggled(self, plant, plant_genome):
+        """ Adds or removes a living plant with the specified genome. """
+        self.value ^= (_split_mix(self._plant_offset + plant.root_x) * (hash(plant_genome.entries) | 1)) & _mask
+
+
+class SteadyStateDetector(object):
+    """ Watches the StateHash and population of an environment after each step for a run that has settled down.
+
+    A cycle is confirmed when the configuration has repeated with the same period, of at most window cycles, for
+    confirm_cycles cycles in a row (or a whole period, if that is longer).  A period of one is a static configuration.
+    Since cell ages are not hashed, a configuration that only looks static because no cell has reached its life span
+    yet must not be mistaken for one, so by default confirm_cycles is twice the environment's cell_life_span.
+    With a stationary_tolerance, the population is also confirmed stationary once the number of living plants has
+    stayed within the tolerance for window cycles.  Once confirmed, kind is "cycle" or "stationary", and detected_time
+    is the time at which it was confirmed.
+    """
+
+    def __init__(self, window=1000, confirm_cycles=None, stationary_tolerance=None):
+        self.window = window
+        self.confirm_cycles = confirm_cycles
+        self.stationary_tolerance = stationary_tolerance
+        self._history = collections.deque(maxlen=window + 1)  # (time, hash, birth count, death count) of each step
+        self._last_seen = {}  # hash -> latest time it was seen, for the hashes in the history
+        self._living = collections.deque(maxlen=window)
+        self._candidate = None  # period that is being confirmed
+        self._streak = 0
+        self.kind = None
+        self.period = None
+        self.detected_time = None
+
+    def end_step(self, env):
+        """ Adds the state after a step to the history, and checks whether a steady state is now confirmed. """
+
+        if self.kind is not None:
+            return
+        value = env.state_hash.value
+        time = env.time
+        if self._candidate is not None and self._history[-self._candidate][1] == value:
+            self._streak += 1
+        else:
+            seen = self._last_seen.get(value)
+            self._candidate = time - seen if seen is not None and time - seen <= self.window else None
+            self._streak = 0 if self._candidate is None else 1
+        if len(self._history) == self._history.maxlen:
+            old_time, old_value, _, _ = self._history[0]
+            if self._last_seen.get(old_value) == old_time:
+                del self._last_seen[old_value]
+        self._history.append((time, value, env.plant_manager.birth_count, env.plant_manager.death_count))
+        self._last_seen[value] = time
+        self._living.append(env.plant_manager.living_count())
+
+        confirm_cycles = 2 * env.cell_life_span if self.confirm_cycles is None else self.confirm_cycles
+        if self._candidate is not None and self._streak >= max(self._candidate, confirm_cycles):
+            self.kind = "cycle"
+            self.period = self._candidate
+            self.detected_time = time
+        elif self.stationary_tolerance is not None and len(self._living) == self._living.maxlen and \
+                max(self._living) - min(self._living) <= self.stationary_tolerance:
+            self.kind = "stationary"
+            self.detected_time = time
+
+    def projected_counts(self, to_time):
+        """ Returns the (birth_count, death_count) that the run would reach at to_time by repeating its confirmed cycle.
+        """
+
+        if self.kind != "cycle":
+            raise ValueError("No cycle has been confirmed")
+        time, _, births, deaths = self._history[-1]
+        start_time, _, start_births, start_deaths = self._history[-1 - self.period]
+        periods, remainder = divmod(to_time - time, self.period)
+        _, _, partial_births, partial_deaths = self._history[-1 - self.period + remainder]
+        return (births + periods * (births - start_births) + partial_births - start_births,
+                deaths + periods * (deaths - start_deaths) + partial_deaths - start_deaths)
@@ -0,0 +1,202 @@
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import environment
+import array_environment
+import batch_environment
+import random_stream
+import sparse_environment
+
+
+def parameter_grid(parameters):
+    """ Returns a list of dictionaries holding every combination of the parameter values.
+
+    parameters: list of (name, list of values) pairs
+    """
+
+    names = [name for name, _ in parameters]
+    return [dict(zip(names, values)) for values in itertools.product(*[values for _, values in parameters])]
+
+
+def run_simulation(run):
+    """ Runs one headless simulation and returns a summary of how it went.
+
+    run: dictionary with the keys run_index, replicate, seed, backend, width, height, plant_count, cycle_count, and
+    parameters (Environment parameters overridden for this run).
+    """
+
+    if run["backend"] == "array":
+        env = array_environment.ArrayEnvironment(run["width"], run["height"], run["seed"])
+    elif run["backend"] == "sparse":
+        env = sparse_environment.SparseEnvironment(run["width"], run["height"], run["seed"])
+    else:
+        env = environment.Environment(run["width"], run["height"], run["seed"])
+    for name, value in run["parameters"].items():
+        setattr(env, name, value)
+    env.plant_manager.basic_plants(env, run["plant_count"])
+
+    peak_plant_count = env.plant_manager.living_count()
+    while env.time < run["cycle_count"] and not env.complete_death():
+        env.step_time()
+        peak_plant_count = max(peak_plant_count, env.plant_manager.living_count())
+    return _summary(run, env, peak_plant_count)
+
+
+def run_batch(runs):
+    """ Runs several headless simulations of the same size in lockstep as one EnvironmentBatch, and returns a list of
+    the summaries of how each went.
+
+    runs: list of dictionaries as for run_simulation, all with the same width, height, plant_count and cycle_count
+    """
+
+    first = runs[0]
+    batch = batch_environment.EnvironmentBatch(first["width"], first["height"], [run["seed"] for run in runs])
+    for member, run in zip(batch.members, runs):
+        for name, value in run["parameters"].items():
+            setattr(member, name, value)
+    batch.basic_plants(first["plant_count"])
+
+    peak_plant_counts = batch.living_counts()
+    while batch.time < first["cycle_count"] and batch.running:
+        batch.step_time()
+        for index in batch.running:
+            peak_plant_counts[index] = max(peak_plant_counts[index], batch.members[index].plant_manager.living_count())
+    return [_summary(run, member, peak_plant_count)
+            for run, member, peak_plant_count in zip(runs, batch.members, peak_plant_counts)]
+
+
+def _run_one(runs):
+    """ Returns a list of the summary of the single run in runs. """
+    return [run_simulation(runs[0])]
+
+
+def _summary(run, env, peak_plant_count):
+    """ Returns the JSON serializable summary of a finished run. """
+
+    genome_sizes = {}
+    for plant in env.plant_manager.plants:
+        if plant.is_alive():
+            genome_sizes[len(plant.genome)] = genome_sizes.get(len(plant.genome), 0) + 1
+    return {"run_index": run["run_index"],
+            "replicate": run["replicate"],
+            "seed": run["seed"],
+            "parameters": run["parameters"],
+            "survival_time": env.time,
+            "survived": not env.complete_death(),
+            "peak_plant_count": peak_plant_count,
+            "final_plant_count": env.plant_manager.living_count(),
+            "births": env.plant_manager.birth_count,
+            "final_genome_sizes": dict((str(size), genome_sizes[size]) for size in sorted(genome_sizes))}
+
+
+def sweep(parameters, replicates, output_path, base_seed=0, processes=None, backend="object", width=300, height=20,
+          plant_count=10, cycle_count=10000, batch_size=1):
+    """ Runs every combination of the parameter values replicates times over a pool of worker processes.
+
+    Each run gets its own seed derived from base_seed, so the whole sweep is reproducible regardless of the number of
+    processes.  A one line JSON summary of each run is appended to output_path as soon as the run completes.  With a
+    batch_size above one, each worker runs batch_size runs at a time in lockstep as an EnvironmentBatch, which uses the
+    array backend, and their summaries are appended when the last of them completes.
+
+    :return: the number of runs
+    """
+
+    runs = []
+    for parameter_values in parameter_grid(parameters):
+        for replicate in range(replicates):
+            runs.append({"run_index": len(runs), "replicate": replicate, "backend": backend, "width": width,
+                         "height": height, "plant_count": plant_count, "cycle_count": cycle_count,
+                         "parameters": parameter_values})
+    for run, seed in zip(runs, random_stream.run_seeds(base_seed, len(runs))):
+        run["seed"] = seed
+
+    if batch_size > 1:
+        if backend != "array":
+            raise ValueError("Batched runs use the array backend, not %s" % backend)
+        work = [runs[start:start + batch_size] for start in range(0, len(runs), batch_size)]
+        run_work = run_batch
+    else:
+        work = [[run] for run in runs]
+        run_work = _run_one
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        with open(output_path, "a") as output:
+            for summaries in pool.imap_unordered(run_work, work):
+                for summary in summaries:
+                    output.write(json.dumps(summary) + "\n")
+                    logging.info("Finished run %d of %d survival_time: %d" % (summary["run_index"] + 1, len(runs),
+                                                                               summary["survival_time"]))
+                output.flush()
+    finally:
+        pool.close()
+        pool.join()
+    return len(runs)
+
+
+def parse_parameter(text):
+    """ Parses a command line parameter of the form name=value1,value2,... into (name, list of values). """
+
+    name, _, values = text.partition("=")
+    if not hasattr(environment.Environment, name) or callable(getattr(environment.Environment, name)) or not values:
+        raise argparse.ArgumentTypeError("expected name=value1,value2,... for an Environment parameter: %s" % text)
+    return name, [_parse_value(value) for value in values.split(",")]
+
+
+def _parse_value(text):
+    """ Converts a parameter value to an int, float, or bool. """
+
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    if text in ("True", "False"):
+        return text == "True"
+    raise argparse.ArgumentTypeError("invalid parameter value: %s" % text)
+
+
+def main():
+    """
+    Runs a parameter sweep over a pool of processes and writes a JSON summary of each run to a results file.
+
+    :return: None
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-p", "--param", dest="parameters", type=parse_parameter, action="append", default=[],
+                        help="Environment parameter and the values to sweep, e.g. seed_spread=10,20,40")
+    parser.add_argument("-r", "--replicates", dest="replicates", type=int, default="1",
+                        help="Number of runs of each combination of parameters")
+    parser.add_argument("-o", "--output", dest="output", default="sweep_results.jsonl",
+                        help="JSON lines file to which run summaries are appended")
+    parser.add_argument("-s", "--seed", dest="seed", type=int, default="0", help="Seed from which run seeds derive")
+    parser.add_argument("-j", "--processes", dest="processes", type=int, default=None,
+                        help="Number of worker processes (defaults to the number of cores)")
+    parser.add_argument("-b", "--backend", dest="backend", choices=["object", "array", "sparse"],
+                        default="object",
+                        help="Grid engine: per-location Python objects, NumPy arrays, or chunks allocated on demand")
+    parser.add_argument("-dx", "--width", dest="width", type=int, default="300", help="Width of environment")
+    parser.add_argument("-dy", "--height", dest="height", type=int, default="20", help="Height of environment")
+    parser.add_argument("-pc", "--plant_count", dest="plant_count", type=int, default="10",
+                        help="Number of initial plants")
+    parser.add_argument("-c", "--cycle_count", dest="cycle_count", type=int, default="10000",
+                        help="Maximum number of cycles to execute in each run")
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default="1",
+                        help="Number of runs each worker advances in lockstep as one batch (array backend only)")
+
+    args = parser.parse_args()
+    if args.batch_size > 1 and args.backend != "array":
+        parser.error("--batch-size requires --backend array")
+
+    run_count = sweep(args.parameters, args.replicates, args.output, base_seed=args.seed, processes=args.processes,
+                      backend=args.backend, width=args.width, height=args.height, plant_count=args.plant_count,
+                      cycle_count=args.cycle_count, batch_size=args.batch_size)
+    print("Wrote %d run summaries to %s" % (run_count, args.output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+import unittest
+import array_environment
+import environment
+import sparse_environment
+
+
+class ConnectivityTest(unittest.TestCase):
+    """ Runs seeded worlds with verify_connectivity set, so that every cycle the incremental search for disconnected
+    cells is checked against a depth first search of the whole grid.
+    """
+
+    def run_verified(self, environment_class, include_diagonal_neighbors, seed):
+        env = environment_class(120, 15, seed)
+        env.verify_connectivity = True
+        env.include_diagonal_neighbors = include_diagonal_neighbors
+        env.plant_manager.basic_plants(env, 6)
+        counters = env.enable_metrics(interval=1000000)
+        while env.time < 600 and not env.complete_death():
+            env.step_time()
+        # Cells must actually have been disconnected for the check to have compared anything interesting
+        self.assertGreater(counters.cells_killed_disconnected, 0)
+
+    def test_environment(self):
+        for include_diagonal_neighbors in (True, False):
+            for seed in (1, 2):
+                self.run_verified(environment.Environment, include_diagonal_neighbors, seed)
+
+    def test_array_environment(self):
+        for include_diagonal_neighbors in (True, False):
+            for seed in (1, 2):
+                self.run_verified(array_environment.ArrayEnvironment, include_diagonal_neighbors, seed)
+
+    def test_sparse_environment(self):
+        for include_diagonal_neighbors in (True, False):
+            self.run_verified(sparse_environment.SparseEnvironment, include_diagonal_neighbors, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+import unittest
+import array_environment
+import batch_environment
+import environment
+import replay
+import sparse_environment
+
+
+def state_of(env):
+    """ Returns the time, random number stream and every plant and living cell of env, for comparing two runs. """
+
+    plants = []
+    for plant in env.plant_manager.plants + env.plant_manager._new_plants:
+        plants.append((plant.id, plant.root_x, plant.root_y, plant.creation_time, plant.energy, plant.is_alive(),
+                       plant.genome.entries, bytes(plant.cell_states),
+                       [(cell.dx, cell.dy, cell.index, cell.creation_time) for cell in plant.living_cells]))
+    return env.time, env.rng.getstate(), plants, env.column_tops.tolist()
+
+
+def basic_environment(environment_class, seed, width=200, height=20, plant_count=8, batched_growth=False):
+    env = environment_class(width, height, seed)
+    env.batched_growth = batched_growth
+    env.plant_manager.basic_plants(env, plant_count)
+    return env
+
+
+class BackendEquivalenceTest(unittest.TestCase):
+    """ The array and sparse backends must match the object backend step for step. """
+
+    def assert_backends_match(self, seed, batched_growth):
+        envs = [basic_environment(environment_class, seed, batched_growth=batched_growth) for environment_class in
+                (environment.Environment, array_environment.ArrayEnvironment, sparse_environment.SparseEnvironment)]
+        while envs[0].time < 600 and not envs[0].complete_death():
+            for env in envs:
+                env.step_time()
+            expected = state_of(envs[0])
+            for env in envs[1:]:
+                self.assertEqual(state_of(env), expected, "%s differs at %d" % (type(env).__name__, env.time))
+        self.assertEqual(envs[1].plant_id_grid().tolist(), envs[0].plant_id_grid().tolist())
+
+    def test_sequential_growth(self):
+        for seed in (1, 2):
+            self.assert_backends_match(seed, False)
+
+    def test_batched_growth(self):
+        self.assert_backends_match(3, True)
+
+
+class CheckpointTest(unittest.TestCase):
+    """ A run restored from a checkpoint must continue exactly as the run that was saved. """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assert_resume_matches(self, environment_class, seed, save_time, batched_growth=False):
+        env = basic_environment(environment_class, seed, batched_growth=batched_growth)
+        while env.time < save_time:
+            env.step_time()
+        path = os.path.join(self.directory, "checkpoint.npz")
+        env.save(path)
+        restored = environment_class.load(path)
+        self.assertEqual(state_of(restored), state_of(env))
+        for _ in range(300):
+            env.step_time()
+            restored.step_time()
+            self.assertEqual(state_of(restored), state_of(env), "differs at %d" % env.time)
+
+    def test_environment(self):
+        self.assert_resume_matches(environment.Environment, 1, 250)
+        self.assert_resume_matches(environment.Environment, 2, 400, batched_growth=True)
+
+    def test_array_environment(self):
+        self.assert_resume_matches(array_environment.ArrayEnvironment, 1, 250)
+        self.assert_resume_matches(array_environment.ArrayEnvironment, 2, 400, batched_growth=True)
+
+    def test_sparse_environment(self):
+        self.assert_resume_matches(sparse_environment.SparseEnvironment, 3, 300)
+
+    def test_before_first_step(self):
+        # The initial plants have not been through a growth phase yet, so they are only in the new plants
+        self.assert_resume_matches(environment.Environment, 1, 0)
+
+
+class BatchTest(unittest.TestCase):
+    """ Each member of an EnvironmentBatch must match an ArrayEnvironment run on its own. """
+
+    def test_members_match_solo_runs(self):
+        seeds = [1, 2, 3, 4]
+        batch = batch_environment.EnvironmentBatch(120, 15, seeds)
+        batch.basic_plants(6)
+        solos = [basic_environment(array_environment.ArrayEnvironment, seed, 120, 15, 6) for seed in seeds]
+        while batch.running and batch.time < 400:
+            batch.step_time()
+            for member, solo in zip(batch.members, solos):
+                if not solo.complete_death():
+                    solo.step_time()
+                self.assertEqual(state_of(member), state_of(solo), "differs at %d" % batch.time)
+
+
+class ReplayTest(unittest.TestCase):
+    """ Seeking in a replay log must reconstruct the world exactly as it was at that cycle. """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_seek(self):
+        env = basic_environment(environment.Environment, 1)
+        recorder = replay.ReplayRecorder(self.directory, env, keyframe_every=200)
+        env.observers.append(recorder)
+        states = {0: state_of(env)}
+        while env.time < 700:
+            env.step_time()
+            if env.time in (1, 199, 200, 457, 700):
+                states[env.time] = state_of(env)
+        recorder.close(env)
+        for time, state in sorted(states.items()):
+            self.assertEqual(state_of(replay.replay(self.directory, time)), state)
+
+
+if __name__ == '__main__':
+    unittest.main()
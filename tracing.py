@@ -0,0 +1,105 @@
+import struct
+import numpy as np
+
+# Kinds of event
+CELL_BORN, CELL_DIED, PLANT_BORN, PLANT_DIED, SEED_LANDED, SEED_BLOCKED, MUTATION = range(7)
+kind_names = ["cell_born", "cell_died", "plant_born", "plant_died", "seed_landed", "seed_blocked", "mutation"]
+
+# Causes of a cell_died event
+LIFE_SPAN, PLANT_DEATH, DISCONNECTED, CROWDED = range(1, 5)
+# Causes of a plant_died event
+ENERGY, NO_CELLS = range(1, 3)
+# Causes of a mutation event
+ADDITION, REMOVAL = range(1, 3)
+
+event_dtype = np.dtype([("time", "<i4"), ("kind", "u1"), ("cause", "u1"), ("plant", "<i4"), ("x", "<i4"),
+                        ("y", "<i4"), ("value", "<i4")])
+_event_struct = struct.Struct("<iBBiiii")
+_file_magic = b"DARWINTRACE1\n"
+
+
+class Tracer(object):
+    """ Records typed simulation events into a preallocated ring buffer of fixed size binary records.
+
+    Each event holds the time, its kind and cause, the registry id of the plant, a location and one extra value: the
+    genome length of a new plant, the age of a cell or plant that died, or the number of cells that a mutation added or
+    removed.
+
+    With a path, the buffer is written to the file as a columnar chunk whenever it fills, so no event is lost.  Without
+    one, the buffer wraps and keeps the most recent capacity events.
+    """
+
+    def __init__(self, path=None, capacity=65536):
+        self.capacity = capacity
+        self.dropped_count = 0
+        self._buffer = bytearray(capacity * _event_struct.size)
+        self._count = 0  # number of records in the buffer, or the position of the next record once it has wrapped
+        self._wrapped = False
+        self._sink = None
+        if path:
+            self._sink = open(path, "wb")
+            self._sink.write(_file_magic)
+
+    def record(self, time, kind, plant_id, x, y, cause=0, value=0):
+        """ Appends an event to the buffer. """
+
+        if self._count == self.capacity:
+            if self._sink is not None:
+                self.flush()
+            else:
+                self._count = 0
+                self._wrapped = True
+        if self._wrapped:
+            self.dropped_count += 1
+        _event_struct.pack_into(self._buffer, self._count * _event_struct.size, time, kind, cause,
+                                -1 if plant_id is None else plant_id, x, y, value)
+        self._count += 1
+
+    def events(self):
+        """ Returns the events in the buffer, oldest first, as a structured array with the fields of event_dtype. """
+
+        records = np.frombuffer(self._buffer, dtype=event_dtype)
+        if self._wrapped:
+            return np.concatenate((records[self._count:], records[:self._count]))
+        return records[:self._count].copy()
+
+    def flush(self):
+        """ Writes the buffered events to the file as one chunk of columns and empties the buffer. """
+
+        if self._sink is None or self._count == 0:
+            return
+        records = np.frombuffer(self._buffer, dtype=event_dtype, count=self._count)
+        self._sink.write(struct.pack("<I", self._count))
+        for name in event_dtype.names:
+            self._sink.write(np.ascontiguousarray(records[name]).tobytes())
+        self._count = 0
+
+    def close(self):
+        """ Writes any buffered events and closes the file. """
+
+        if self._sink is not None:
+            self.flush()
+            self._sink.close()
+            self._sink = None
+
+
+def read(path):
+    """ Reads a trace file written by a Tracer and returns its events as a dictionary of field name to column array.
+    kind_names gives the name of each value of the kind column.
+    """
+
+    with open(path, "rb") as trace_file:
+        data = trace_file.read()
+    if not data.startswith(_file_magic):
+        raise ValueError("%s is not a trace file" % path)
+    chunks = dict((name, []) for name in event_dtype.names)
+    offset = len(_file_magic)
+    while offset < len(data):
+        count, = struct.unpack_from("<I", data, offset)
+        offset += 4
+        for name in event_dtype.names:
+            field_dtype = event_dtype.fields[name][0]
+            chunks[name].append(np.frombuffer(data, dtype=field_dtype, count=count, offset=offset))
+            offset += count * field_dtype.itemsize
+    return dict((name, np.concatenate(columns) if columns else np.zeros(0, dtype=event_dtype.fields[name][0]))
+                for name, columns in chunks.items())